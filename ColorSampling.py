@@ -0,0 +1,88 @@
+import numpy as np
+
+# numeric helpers of ImageColorSampler, numpy only so they can be tested without ComfyUI
+
+
+def window_means(img_np, xs, ys, radius):
+    """
+    Average color of the (2 * radius + 1)^2 window centered on each point, all points at once.
+    Windows are read with one gather when that touches fewer values than the image,
+    otherwise from a summed-area table built once, so the cost doesn't grow with the radius.
+
+    Args:
+        img_np: Image array [H, W, C]
+        xs, ys: Integer arrays of window centers, already clamped so windows fit in the image
+        radius: Window radius
+
+    Returns:
+        Float32 array [N, C] of window averages
+    """
+    height, width, channels = img_np.shape
+    size = 2 * radius + 1
+    if len(xs) * size * size <= height * width:
+        offsets = np.arange(-radius, radius + 1)
+        windows = img_np[(ys[:, None] + offsets)[:, :, None], (xs[:, None] + offsets)[:, None, :]]
+        return windows.mean(axis=(1, 2), dtype=np.float64).astype(np.float32)
+
+    # summed-area table with a leading row and column of zeros, sums of any window in 4 lookups
+    table = np.zeros((height + 1, width + 1, channels), dtype=np.float64)
+    np.cumsum(np.cumsum(img_np, axis=0, dtype=np.float64), axis=1, out=table[1:, 1:])
+    top, bottom = ys - radius, ys + radius + 1
+    left, right = xs - radius, xs + radius + 1
+    sums = table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left]
+    return (sums / (size * size)).astype(np.float32)
+
+
+def median_cut(pixels, num_colors):
+    """
+    Dominant colors of a set of pixels by median cut: the box with the widest channel range
+    is split at the median of that channel until there are num_colors boxes
+    (or no box with more than one color is left).
+
+    Args:
+        pixels: Float array [N, 3]
+        num_colors: Maximum number of colors
+
+    Returns:
+        Tuple of (float32 array [K, 3] of box averages, array [K] of pixel counts), most common first
+    """
+    boxes = [pixels]
+    ranges = [np.ptp(pixels, axis=0)]
+    while len(boxes) < num_colors:
+        widest = [box_range.max() if len(box) > 1 else 0.0 for box, box_range in zip(boxes, ranges)]
+        index = int(np.argmax(widest))
+        if widest[index] <= 0:
+            break
+        box = boxes.pop(index)
+        channel = int(np.argmax(ranges.pop(index)))
+        half = len(box) // 2
+        order = np.argpartition(box[:, channel], half)
+        for part in (box[order[:half]], box[order[half:]]):
+            boxes.append(part)
+            ranges.append(np.ptp(part, axis=0))
+
+    colors = np.array([box.mean(axis=0) for box in boxes], dtype=np.float32)
+    counts = np.array([len(box) for box in boxes])
+    order = np.argsort(-counts, kind="stable")
+    return colors[order], counts[order]
+
+
+def color_stripes(colors, palette_size):
+    """
+    Palette image as a horizontal strip of equal stripes, the last one taking the remainder.
+
+    Args:
+        colors: Float array [N, 3] of colors in 0-1
+        palette_size: Width and height of the palette
+
+    Returns:
+        Float32 array [palette_size, palette_size, 3]
+    """
+    num_colors = len(colors)
+    stripe_width = palette_size // num_colors
+    if stripe_width == 0:
+        # more colors than columns, the last stripe covers everything
+        columns = np.full(palette_size, num_colors - 1)
+    else:
+        columns = np.minimum(np.arange(palette_size) // stripe_width, num_colors - 1)
+    return np.ascontiguousarray(np.broadcast_to(colors[columns][None], (palette_size, palette_size, 3)), dtype=np.float32)
@@ -1,4 +1,7 @@
 import folder_paths
+import os
+import time
+import comfy.model_management
 from PIL import Image, ImageOps
 import numpy as np
 import torch
@@ -7,194 +10,69 @@ import threading
 from server import PromptServer
 from aiohttp import web
 import json # Added import for json parsing
+import hashlib
+from .CompositorCache import LRUCache, cache_registry, fingerprint_tensor
+from .CompositorLayers import composite_layers, layer_alpha, position_layers, sparse_layer, stack_variants
+from .CompositorMasksOutputV3 import match_frames
+from .CompositorTransformsOut3 import interpolate_keyframes, parse_transforms
 
 thread = None
 g_node_id = None
 g_filename = None
 threads = []
 
-# Helper functions (assuming these are standard ComfyUI tensor/PIL conversions)
-def tensor2pil(image: torch.Tensor) -> Image.Image:
-    return Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(0), 0, 255).astype(np.uint8))
-
-def pil2tensor(image: Image.Image) -> torch.Tensor:
-    return torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
-
-# Function to create an empty mask tensor of specified dimensions
-def create_empty_mask(width, height, inverted=False):
-    """
-    Create an empty mask tensor with specified dimensions.
-    
-    Parameters:
-    - width: Width of the mask
-    - height: Height of the mask
-    - inverted: If True, creates a white mask (all 255), otherwise black mask (all 0)
-    
-    Returns:
-    - Tensor representing an empty mask
-    """
-    try:
-        # Create a black image (all zeros) or white image (all 255) of the specified dimensions
-        value = 255 if inverted else 0
-        empty_mask = Image.new('L', (width, height), value)
-        # Convert to tensor
-        return pil2tensor(empty_mask)
-    except Exception as e:
-        print(f"Error creating empty mask: {e}")
-        # As a fallback, create a 1x1 pixel mask
-        value = 255 if inverted else 0
-        fallback_mask = Image.new('L', (1, 1), value)
-        return pil2tensor(fallback_mask)
-
-# Add a new helper function for placing images on a canvas with proper positioning
-def place_on_canvas(image_tensor, canvas_width, canvas_height, left, top, scale_x=1.0, scale_y=1.0, mask_tensor=None, invert_mask=True):
-    """
-    Place an image tensor on a canvas of specified dimensions at the given position.
-    Images exceeding canvas boundaries will be truncated.
-    Preserves transparency of original image and ensures areas not covered by image are transparent.
-    
-    Parameters:
-    - image_tensor: Torch tensor image to place
-    - canvas_width, canvas_height: Dimensions of the target canvas
-    - left, top: Position to place the image (top-left corner)
-    - scale_x, scale_y: Optional scaling factors
-    - mask_tensor: Optional mask tensor to apply to the image
-    - invert_mask: Whether to invert the final mask (True means white=masked, black=unmasked)
-    
-    Returns:
-    - Tuple of (positioned image tensor, positioned mask tensor)
-    """
-    if image_tensor is None:
-        return None, None
-        
-    try:
-        # Convert tensor to PIL for manipulation
-        pil_image = tensor2pil(image_tensor)
-        
-        # Convert to RGBA to preserve transparency
-        if pil_image.mode != 'RGBA':
-            pil_image = pil_image.convert('RGBA')
-            
-        # Create alpha channel if not already present
-        if len(pil_image.split()) < 4:
-            r, g, b = pil_image.split()
-            alpha = Image.new('L', pil_image.size, 255)  # Start with fully opaque
-            pil_image = Image.merge('RGBA', (r, g, b, alpha))
-            
-        # Convert mask tensor to PIL if provided
-        pil_mask = None
-        if mask_tensor is not None:
-            pil_mask = tensor2pil(mask_tensor)
-            # Convert to grayscale if it's not already
-            if pil_mask.mode != 'L':
-                pil_mask = pil_mask.convert('L')
-        
-        # Apply scaling if needed (different from 1.0)
-        original_width, original_height = pil_image.size
-        if scale_x != 1.0 or scale_y != 1.0:
-            new_width = max(1, int(original_width * scale_x))
-            new_height = max(1, int(original_height * scale_y))
-            if new_width > 0 and new_height > 0:  # Ensure dimensions are valid
-                pil_image = pil_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                if pil_mask is not None:
-                    pil_mask = pil_mask.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        
-        # Create a transparent canvas for the image (RGBA with alpha=0)
-        canvas = Image.new('RGBA', (canvas_width, canvas_height), (0, 0, 0, 0))
-        
-        # Create a mask canvas - start with fully masked (255 for inverted masks)
-        # This ensures anything outside the bounding box is considered masked
-        mask_canvas = Image.new('L', (canvas_width, canvas_height), 255 if invert_mask else 0)
-        
-        # Calculate position with integer precision
-        pos_left = int(left)
-        pos_top = int(top)
-        
-        # Paste the image onto the canvas with transparency
-        # PIL will handle truncation automatically when the image extends beyond canvas boundaries
-        canvas.paste(pil_image, (pos_left, pos_top), pil_image.split()[3])  # Use alpha channel as mask
-        
-        # Get the dimensions of the placed image
-        placed_width = min(pil_image.width, canvas_width - pos_left) if pos_left < canvas_width else 0
-        placed_height = min(pil_image.height, canvas_height - pos_top) if pos_top < canvas_height else 0
-        
-        # Create a bounding box mask (black inside bounding box, white outside)
-        if placed_width > 0 and placed_height > 0:
-            # For the area where the image is placed, we need to:
-            # - If invert_mask=False: Set to 0 (unmasked) where image exists
-            # - If invert_mask=True: Set to 0 (masked) where image exists
-            bbox_value = 0
-            
-            # Create a temporary mask for the bounding box area
-            bbox_rect = Image.new('L', (placed_width, placed_height), bbox_value)
-            
-            # Paste this rectangle onto our mask canvas at the image position
-            # For inverted masks, this means the area where the image will be placed starts as unmasked (0)
-            # and the rest of the canvas is masked (255)
-            mask_canvas.paste(bbox_rect, (pos_left, pos_top))
-        
-        # Process the input mask if provided
-        if pil_mask is not None:
-            # Create a temporary transparent canvas for the input mask
-            input_mask_canvas = Image.new('L', (canvas_width, canvas_height), 0)
-            
-            # Paste the input mask at the correct position
-            input_mask_canvas.paste(pil_mask, (pos_left, pos_top))
-            
-            # If we're using inverted masks, we need to invert the input mask before combining
-            if invert_mask:
-                input_mask_canvas = ImageOps.invert(input_mask_canvas)
-            
-            # Now combine with our bounding box mask
-            # For inverted masks, we use the minimum value (logical AND) 
-            # This ensures that:
-            # - Areas outside bbox are always masked (255 for inverted)
-            # - Areas inside bbox are masked according to input mask
-            mask_array = np.array(mask_canvas)
-            input_mask_array = np.array(input_mask_canvas)
-            
-            if invert_mask:
-                # For inverted masks: black=unmasked (0), white=masked (255)
-                # Take the maximum value at each point (logical OR)
-                combined_array = np.maximum(mask_array, input_mask_array)
-            else:
-                # For normal masks: white=unmasked (255), black=masked (0)
-                # Take the minimum value at each point (logical AND)
-                combined_array = np.minimum(mask_array, input_mask_array)
-            
-            # Convert back to PIL
-            mask_canvas = Image.fromarray(combined_array.astype(np.uint8))
-        
-        # Convert back to tensor - need to handle RGBA to RGB conversion for ComfyUI compatibility
-        # First extract RGB channels and create an RGB image
-        r, g, b, a = canvas.split()
-        rgb_image = Image.merge('RGB', (r, g, b))
-        
-        # Convert back to tensors
-        positioned_image_tensor = pil2tensor(rgb_image)
-        positioned_mask_tensor = pil2tensor(mask_canvas)
-        
-        return positioned_image_tensor, positioned_mask_tensor
-    except Exception as e:
-        print(f"Error placing image on canvas: {e}")
-        return image_tensor, mask_tensor  # Return original on error
-
+# (prompt id, node id) -> composite waiting in-process for the browser upload, see Compositor3.await_composition
+awaiting = {}
 
 routes = PromptServer.instance.routes
 @routes.post('/compositor/done')
 async def receivedDone(request):
-    return web.json_response({})
+    data = await request.post()
+    node_id = str(data.get("node_id"))
+    prompt_id = data.get("prompt_id")
+    # the wait of this prompt, or the node's latest one for clients that don't send the prompt id,
+    # only the client that queued the prompt resumes it
+    found = [pending for (pending_prompt_id, pending_node_id), pending in awaiting.items()
+             if pending_node_id == node_id and (not prompt_id or pending_prompt_id == prompt_id)
+             and pending["client_id"] in (None, data.get("client_id"))]
+    pending = found[-1] if found else None
+    if pending is not None:
+        pending["imageName"] = data.get("filename")
+        pending["fabricData"] = data.get("fabricData")
+        pending["event"].set()
+    return web.json_response({"resumed": pending is not None})
+
+@routes.get('/compositor/cache')
+async def cacheStats(request):
+    return web.json_response({name: cache.stats() for name, cache in cache_registry.items()})
+
+# resize or clear a cache, e.g. {"name": "compositor_images", "max_entries": 16} or {"name": "...", "clear": true}
+@routes.post('/compositor/cache')
+async def cacheConfigure(request):
+    data = await request.json()
+    cache = cache_registry.get(data.get("name"))
+    if cache is None:
+        return web.json_response({"error": "unknown cache"}, status=404)
+    if data.get("clear", False):
+        cache.clear()
+    cache.resize(max_bytes=data.get("max_bytes"), max_entries=data.get("max_entries"))
+    return web.json_response(cache.stats())
 
 class Compositor3:
     file = "new.png"
     result = None
     configCache = None
+    # positioned layers shared by all instances, bounded by the config's layerCacheMB
+    layer_cache = LRUCache("compositor_layers")
+    # decoded uploads keyed by path, mtime and size, re-runs on an unchanged composite skip decoding
+    image_cache = LRUCache("compositor_images", max_bytes=1024 * 1024 * 1024, max_entries=8)
 
     @classmethod
     def IS_CHANGED(cls, **kwargs):
         fabricData = kwargs.get("fabricData")
         # print(fabricData)
-        return fabricData
+        # a short digest instead of the whole transforms document
+        return hashlib.blake2b(str(fabricData).encode("utf-8"), digest_size=16).hexdigest()
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -215,11 +93,176 @@ class Compositor3:
         }
 
     # Updated RETURN_TYPES to use new COMPOSITOR_OUTPUT_MASKS type
-    RETURN_TYPES = ("STRING", "IMAGE", "COMPOSITOR_OUTPUT_MASKS")
-    RETURN_NAMES = ("transforms", "image", "layer_outputs")
+    # transform_data is the transforms document parsed once, see CompositorTransformsOutAllV3
+    RETURN_TYPES = ("STRING", "IMAGE", "COMPOSITOR_OUTPUT_MASKS", "COMPOSITOR_TRANSFORMS")
+    RETURN_NAMES = ("transforms", "image", "layer_outputs", "transform_data")
     FUNCTION = "composite"
     CATEGORY = "image"
 
+    def load_image(self, image_path):
+        """Decode the uploaded composite, reusing the previous decode while the file is unchanged"""
+        stat = os.stat(image_path)
+        cache_key = (image_path, stat.st_mtime_ns, stat.st_size)
+        image = self.image_cache.get(cache_key)
+        if image is None:
+            i = Image.open(image_path)
+            i = ImageOps.exif_transpose(i)
+            if i.mode == 'I':
+                i = i.point(lambda i: i * (1 / 255))
+            image = i.convert("RGB")
+            image = np.array(image).astype(np.float32) / 255.0
+            image = torch.from_numpy(image)[None, ]
+            self.image_cache.put(cache_key, image)
+        return image
+
+    def await_composition(self, prompt_id, node_id, timeout):
+        """
+        Wait for the browser to upload the composition, signalled through /compositor/done.
+        Interrupting the prompt cancels the wait.
+
+        Returns (imageName, fabricData) or None on timeout
+        """
+        pending = awaiting[(prompt_id, str(node_id))]
+        deadline = time.monotonic() + timeout
+        try:
+            while not pending["event"].wait(0.1):
+                comfy.model_management.throw_exception_if_processing_interrupted()
+                if time.monotonic() > deadline:
+                    print(f"Compositor {node_id}: no composition received after {timeout}s, blocking")
+                    return None
+            return pending["imageName"], pending["fabricData"]
+        finally:
+            awaiting.pop((prompt_id, str(node_id)), None)
+
+    def position_layers(self, pending_layers, canvas_width, canvas_height, workers=1):
+        """
+        Position the layers missing from the layer cache and store them cropped.
+        pending_layers is a list of (cache key, position_layer arguments), see position_layers
+        for the worker pool.
+
+        Returns the list of (sparse image, sparse mask) tuples, in the order of pending_layers
+        """
+        positioned = position_layers([arguments for _, arguments in pending_layers], canvas_width, canvas_height, workers)
+        return [self.layer_cache.put(cache_key, layer) for (cache_key, _), layer in zip(pending_layers, positioned)]
+
+    def collect_layers(self, layout, extendedConfig, canvas_width, canvas_height, padding, invertMask, headless, placement, preview_scales):
+        """
+        Look up the positioned layers of one layout (a parsed fabricData document) in the layer cache.
+
+        Returns (images, masks, blend_layers, missing): the 8 layers and masks, left as None for the layers
+        in missing, a list of (index, cache key, position_layer arguments, blend) still to position.
+        blend_layers are the 8 (image, mask) pairs a headless composite blends (None otherwise): each layer
+        positioned with layer_alpha as its mask so rotated corners stay transparent, while the output
+        masks stay the ones of the browser mode
+        """
+        # Get both transforms and bboxes arrays
+        fabric_transforms = layout.get('transforms', [])
+        fabric_bboxes = layout.get('bboxes', [])
+        # optional per layer keyframe tracks, see interpolate_keyframes
+        fabric_keyframes = layout.get('keyframes') or []
+        
+        # Make sure we have valid arrays
+        if not fabric_transforms:
+            fabric_transforms = [{} for _ in range(8)]
+        if not fabric_bboxes:
+            fabric_bboxes = [{} for _ in range(8)]
+
+        # (index, cache key, position_layer arguments, blend) of the layers (and blend layers) missing from the cache
+        missing = []
+        rotated_images = [None] * 8
+        rotated_masks = [None] * 8  # Array to hold transformed masks
+        blend_layers = [(None, None)] * 8 if headless else None
+        for idx in range(8):
+            image_key = f"image{idx + 1}"
+            mask_key = f"mask{idx + 1}"
+            # Get image and mask from extendedConfig, return None if not found
+            original_image_tensor = extendedConfig.get(image_key) if extendedConfig else None
+            original_mask_tensor = extendedConfig.get(mask_key) if extendedConfig else None
+
+            if original_image_tensor is not None and idx < len(fabric_transforms):
+                # Get transformation data for rotation and scaling
+                transform = fabric_transforms[idx]
+                angle = transform.get('angle', 0)
+                scale_x = transform.get('scaleX', 1.0)
+                scale_y = transform.get('scaleY', 1.0)
+                # the ui transforms a preview that can be smaller than the layer (proxy, normalizeHeight)
+                if idx < len(preview_scales) and preview_scales[idx]:
+                    scale_x *= preview_scales[idx][0]
+                    scale_y *= preview_scales[idx][1]
+                
+                # Get positioning data from bboxes (these are the actual coordinates to use)
+                bbox = fabric_bboxes[idx] if idx < len(fabric_bboxes) else {'left': 0, 'top': 0}
+                left = bbox.get('left', 0)
+                top = bbox.get('top', 0)
+
+                keyframes = fabric_keyframes[idx] if idx < len(fabric_keyframes) else None
+                if keyframes:
+                    # one value per frame, placed as a batch of affine transforms
+                    # a start/end track without a frame count spans the layer's frames
+                    frames = layout.get("frames") or (original_image_tensor.shape[0] if isinstance(keyframes, dict) else None)
+                    frame_transforms, frame_bboxes = interpolate_keyframes(keyframes, transform, bbox, frames)
+                    preview_scale = preview_scales[idx] if idx < len(preview_scales) and preview_scales[idx] else (1.0, 1.0)
+                    angle = tuple(t.get('angle', 0) for t in frame_transforms)
+                    scale_x = tuple(t.get('scaleX', 1.0) * preview_scale[0] for t in frame_transforms)
+                    scale_y = tuple(t.get('scaleY', 1.0) * preview_scale[1] for t in frame_transforms)
+                    left = tuple(b.get('left', 0) for b in frame_bboxes)
+                    top = tuple(b.get('top', 0) for b in frame_bboxes)
+
+                print(f"Processing image {idx+1}: angle={angle}, position=({left},{top}), scale=({scale_x},{scale_y})")
+                if original_mask_tensor is not None:
+                    print(f"   - Mask found for image {idx+1}")
+
+                cache_key = (
+                    fingerprint_tensor(original_image_tensor), fingerprint_tensor(original_mask_tensor), placement,
+                    angle, scale_x, scale_y, left, top, padding, canvas_width, canvas_height,
+                )
+                positioned = self.layer_cache.get(cache_key)
+                if positioned is None:
+                    # positioned below, possibly in parallel with the other changed layers
+                    missing.append((idx, cache_key, (
+                        original_image_tensor,
+                        original_mask_tensor,
+                        canvas_width,
+                        canvas_height,
+                        left,
+                        top,
+                        padding,
+                        angle,
+                        scale_x,
+                        scale_y,
+                        placement
+                    ), False))
+                else:
+                    rotated_images[idx], rotated_masks[idx] = positioned
+
+                if headless:
+                    blend_key = ("blend", invertMask) + cache_key
+                    positioned = self.layer_cache.get(blend_key)
+                    if positioned is None:
+                        missing.append((idx, blend_key, (
+                            original_image_tensor,
+                            layer_alpha(original_image_tensor, original_mask_tensor, invertMask),
+                            canvas_width,
+                            canvas_height,
+                            left,
+                            top,
+                            padding,
+                            angle,
+                            scale_x,
+                            scale_y,
+                            placement
+                        ), True))
+                    else:
+                        blend_layers[idx] = positioned
+            elif original_image_tensor is not None:
+                # No transform data, just use the original
+                rotated_images[idx] = original_image_tensor
+                rotated_masks[idx] = original_mask_tensor  # Use original mask if available
+                if headless:
+                    blend_layers[idx] = (original_image_tensor, layer_alpha(original_image_tensor, original_mask_tensor, invertMask))
+
+        return rotated_images, rotated_masks, blend_layers, missing
+
     def composite(self, **kwargs):
         # https://blog.miguelgrinberg.com/post/how-to-make-python-wait
         node_id = kwargs.pop('node_id', None)
@@ -235,16 +278,40 @@ class Compositor3:
         height = config["height"]
         config_node_id = config["node_id"]
         onConfigChanged = config["onConfigChanged"]
+        # requeue: block and let the browser re-enqueue the prompt, await: wait here for /compositor/done
+        awaitMode = config.get("continueMode", "requeue") == "await"
+        awaitTimeout = config.get("awaitTimeout", 300)
         names = config["names"]
+        placement = config.get("placement", "pil")
+        preview_scales = config.get("previewScales") or []
+        # browser: the fabric canvas uploads the composite, server: render it here without waiting for the UI
+        headless = config.get("render", "browser") == "server"
         fabricData = kwargs.get("fabricData")
+        # a layout sweep (json array of fabricData) can only be rendered here, the browser shows a single layout
+        sweep = isinstance(fabricData, str) and fabricData.lstrip().startswith("[")
+        headless = headless or sweep
 
-        configChanged = self.configCache != config
+        # the config node fingerprints its output, compare that instead of the whole dict
+        configKey = config.get("fingerprint") or config
+        configChanged = self.configCache != configKey
         # print(configChanged)
         # print(config)
         # print(self.configCache)
 
 
-        self.configCache = config
+        self.configCache = configKey
+
+        imageExists = headless or folder_paths.exists_annotated_filepath(imageName)
+        # block when config changed, unless the composite is rendered server side
+        shouldBlock = not headless and (imageName == "new.png" or not imageExists or configChanged)
+        shouldAwait = shouldBlock and awaitMode
+        # the prompt being executed and the client that queued it, several can wait on the same node id
+        prompt_id = getattr(PromptServer.instance, "last_prompt_id", None)
+        client_id = getattr(PromptServer.instance, "client_id", None)
+        if shouldAwait:
+            # register before notifying the browser, the upload may come back quickly
+            awaiting[(prompt_id, str(node_id))] = {"event": threading.Event(), "imageName": None, "fabricData": None, "client_id": client_id}
+
         ui = {
             "test": ("value",),
             "padding": [padding],
@@ -257,15 +324,29 @@ class Compositor3:
             "awaited": [self.result],
             "configChanged": [configChanged],
             "onConfigChanged": [onConfigChanged],
+            "awaiting": [shouldAwait],
+            "prompt_id": [prompt_id],
+            # server side render, the browser must not upload, interrupt or re-enqueue
+            "headless": [headless],
+            # the browser must keep the array of layouts, it would serialize back a single one
+            "sweep": [sweep],
         }
 
         # break and send a message to the gui as if it was "executed" below
         detail = {"output": ui, "node": node_id}
         PromptServer.instance.send_sync("compositor_init", detail)
 
-        imageExists = folder_paths.exists_annotated_filepath(imageName)
-        # block when config changed
-        if imageName == "new.png" or not imageExists or configChanged:
+        if shouldAwait:
+            # resume this execution with the uploaded composition instead of re-running the graph
+            resumed = self.await_composition(prompt_id, node_id, awaitTimeout)
+            if resumed is not None:
+                imageName, awaitedFabricData = resumed
+                if awaitedFabricData:
+                    fabricData = awaitedFabricData
+                    ui["fabricData"] = [fabricData]
+                shouldBlock = not folder_paths.exists_annotated_filepath(imageName)
+
+        if shouldBlock:
             # Return ExecutionBlocker for all outputs if blocked
             blocker_result = tuple([ExecutionBlocker(None)] * len(self.RETURN_TYPES))
             return {
@@ -273,14 +354,12 @@ class Compositor3:
                 "result": blocker_result
             }
         else: # Only process images if not blocked
-            image_path = folder_paths.get_annotated_filepath(imageName)
-            i = Image.open(image_path)
-            i = ImageOps.exif_transpose(i)
-            if i.mode == 'I':
-                i = i.point(lambda i: i * (1 / 255))
-            image = i.convert("RGB")
-            image = np.array(image).astype(np.float32) / 255.0
-            image = torch.from_numpy(image)[None, ]
+            if headless:
+                # rendered from the layers below, this is the fallback for unparsable fabricData
+                image = torch.zeros((1, height, width, 3), dtype=torch.float32)
+            else:
+                # the browser renders a single frame, sequences are composited with render "server"
+                image = self.load_image(folder_paths.get_annotated_filepath(imageName))
 
             # --- Image Rotation Logic ---
             rotated_images = [None] * 8
@@ -290,118 +369,63 @@ class Compositor3:
             
             try:
                 fabric_data_parsed = json.loads(fabricData)
-                # Get canvas dimensions from fabric data if available
-                canvas_width = int(fabric_data_parsed.get("width", 512))
-                canvas_height = int(fabric_data_parsed.get("height", 512))
+                # Get canvas dimensions from fabric data if available, variants share the first layout's canvas
+                first_layout = (fabric_data_parsed[0] if fabric_data_parsed else {}) if isinstance(fabric_data_parsed, list) else fabric_data_parsed
+                canvas_width = int(first_layout.get("width", width))
+                canvas_height = int(first_layout.get("height", height))
                 print(f"Canvas dimensions: {canvas_width}x{canvas_height}")
                 
-                # Get both transforms and bboxes arrays
-                fabric_transforms = fabric_data_parsed.get('transforms', [])
-                fabric_bboxes = fabric_data_parsed.get('bboxes', [])
-                
-                # Make sure we have valid arrays
-                if not fabric_transforms:
-                    fabric_transforms = [{} for _ in range(8)]
-                if not fabric_bboxes:
-                    fabric_bboxes = [{} for _ in range(8)]
+                # a json array of layouts renders every variant of the same layers in this run (layout sweep)
+                layouts = (fabric_data_parsed if isinstance(fabric_data_parsed, list) else [fabric_data_parsed]) or [{}]
 
                 # Initialize empty dictionary if extendedConfig is None
                 if extendedConfig is None:
                     extendedConfig = {}
 
-                for idx in range(8):
-                    image_key = f"image{idx + 1}"
-                    mask_key = f"mask{idx + 1}"
-                    # Get image and mask from extendedConfig, return None if not found
-                    original_image_tensor = extendedConfig.get(image_key) if extendedConfig else None
-                    original_mask_tensor = extendedConfig.get(mask_key) if extendedConfig else None
-
-                    if original_image_tensor is not None and idx < len(fabric_transforms):
-                        # Get transformation data for rotation and scaling
-                        transform = fabric_transforms[idx]
-                        angle = transform.get('angle', 0)
-                        scale_x = transform.get('scaleX', 1.0)
-                        scale_y = transform.get('scaleY', 1.0)
-                        
-                        # Get positioning data from bboxes (these are the actual coordinates to use)
-                        bbox = fabric_bboxes[idx] if idx < len(fabric_bboxes) else {'left': 0, 'top': 0}
-                        left = bbox.get('left', 0)
-                        top = bbox.get('top', 0)
-                        
-                        print(f"Processing image {idx+1}: angle={angle}, position=({left},{top}), scale=({scale_x},{scale_y})")
-                        if original_mask_tensor is not None:
-                            print(f"   - Mask found for image {idx+1}")
-
-                        # First rotate if needed
-                        if angle != 0:
-                            try:
-                                pil_image = tensor2pil(original_image_tensor)
-                                rotated_pil = pil_image.rotate(-angle, expand=True, resample=Image.Resampling.BILINEAR)
-                                rotated_tensor = pil2tensor(rotated_pil)
-                                
-                                # Handle mask rotation if mask exists
-                                rotated_mask_tensor = None
-                                if original_mask_tensor is not None:
-                                    pil_mask = tensor2pil(original_mask_tensor)
-                                    rotated_pil_mask = pil_mask.rotate(-angle, expand=True, resample=Image.Resampling.BILINEAR)
-                                    rotated_mask_tensor = pil2tensor(rotated_pil_mask)
-                                
-                                # Place the rotated image and mask on canvas using bbox position
-                                positioned_tensor, positioned_mask = place_on_canvas(
-                                    rotated_tensor, 
-                                    canvas_width, 
-                                    canvas_height,
-                                    left - padding,  # Subtract padding from left position
-                                    top - padding,   # Subtract padding from top position
-                                    scale_x,
-                                    scale_y,
-                                    rotated_mask_tensor
-                                )
-                                rotated_images[idx] = positioned_tensor
-                                rotated_masks[idx] = positioned_mask
-                            except Exception as e:
-                                print(f"Error processing image {idx+1}: {e}")
-                                # Fallback - place the original image using bbox position
-                                positioned_tensor, positioned_mask = place_on_canvas(
-                                    original_image_tensor,
-                                    canvas_width,
-                                    canvas_height,
-                                    left,
-                                    top,
-                                    scale_x,
-                                    scale_y,
-                                    original_mask_tensor
-                                )
-                                rotated_images[idx] = positioned_tensor
-                                rotated_masks[idx] = positioned_mask
+                self.layer_cache.resize(max_bytes=int(config.get("layerCacheMB", 512)) * 1024 * 1024)
+
+                variants = [
+                    self.collect_layers(layout, extendedConfig, canvas_width, canvas_height, padding, invertMask, headless, placement, preview_scales)
+                    for layout in layouts
+                ]
+
+                # layers missing from the cache are positioned once, even when several variants share a transform
+                pending_layers = {}
+                for _, _, _, missing in variants:
+                    for _, cache_key, arguments, _ in missing:
+                        pending_layers.setdefault(cache_key, arguments)
+                positioned_layers = dict(zip(pending_layers, self.position_layers(list(pending_layers.items()), canvas_width, canvas_height, int(config.get("layerWorkers", 1)))))
+
+                for variant_images, variant_masks, blend_layers, missing in variants:
+                    for idx, cache_key, _, blend in missing:
+                        if blend:
+                            blend_layers[idx] = positioned_layers[cache_key]
                         else:
-                            # No rotation needed, just position and scale using bbox position
-                            # Subtract padding from left and top coordinates to correctly position in output
-                            positioned_tensor, positioned_mask = place_on_canvas(
-                                original_image_tensor,
-                                canvas_width,
-                                canvas_height,
-                                left - padding,  # Subtract padding from left position
-                                top - padding,   # Subtract padding from top position
-                                scale_x,
-                                scale_y,
-                                original_mask_tensor
-                            )
-                            rotated_images[idx] = positioned_tensor
-                            rotated_masks[idx] = positioned_mask
-                    elif original_image_tensor is not None:
-                        # No transform data, just use the original
-                        rotated_images[idx] = original_image_tensor
-                        rotated_masks[idx] = original_mask_tensor  # Use original mask if available
-
-                # Before returning results, replace any None mask values with empty masks
-                # to ensure the workflow doesn't break when connecting to mask inputs
-                for idx in range(8):
-                    if rotated_masks[idx] is None:
-                        # Create empty mask with the same dimensions as canvas
-                        rotated_masks[idx] = create_empty_mask(canvas_width, canvas_height)
-                
-                # Create a dictionary to hold all images and masks
+                            variant_images[idx], variant_masks[idx] = positioned_layers[cache_key]
+
+                    # Before returning results, replace any None mask values with empty masks
+                    # to ensure the workflow doesn't break when connecting to mask inputs
+                    for idx in range(8):
+                        if variant_masks[idx] is None:
+                            # Empty (black) mask with the same dimensions as canvas, allocated only when unpacked
+                            variant_masks[idx] = sparse_layer(None, 0.0)
+
+                if headless:
+                    # blended from the layers positioned with their alpha, the outputs keep the browser mode masks
+                    composites = [composite_layers([layer[0] for layer in blend_layers], [layer[1] for layer in blend_layers], canvas_width, canvas_height)
+                                  for _, _, blend_layers, _ in variants]
+                    batch_size = max(composite.shape[0] for composite in composites)
+                    image = torch.cat([match_frames(composite, batch_size) for composite in composites])
+
+                if len(variants) == 1:
+                    rotated_images, rotated_masks, _, _ = variants[0]
+                else:
+                    # variants follow each other in the batch of every layer output
+                    rotated_images = [stack_variants([variant[0][idx] for variant in variants]) for idx in range(8)]
+                    rotated_masks = [stack_variants([variant[1][idx] for variant in variants]) for idx in range(8)]
+
+                # Create a dictionary to hold all images and masks, positioned layers are sparse
+                # (see sparse_layer) and expanded to the canvas by CompositorMasksOutputV3
                 compositor_output_masks = {
                     "images": rotated_images,
                     "masks": rotated_masks,
@@ -409,9 +433,12 @@ class Compositor3:
                     "canvas_height": canvas_height
                 }
                 
+                layer_frames = [extendedConfig.get(f"image{idx + 1}").shape[0] if extendedConfig.get(f"image{idx + 1}") is not None else None for idx in range(8)]
+                transform_data = parse_transforms(fabric_data_parsed, layer_frames=layer_frames)
+
                 return {
                     "ui": ui,
-                    "result": (fabricData, image, compositor_output_masks)
+                    "result": (fabricData, image, compositor_output_masks, transform_data)
                 }
             except json.JSONDecodeError:
                 print("Error parsing fabricData JSON. Skipping image positioning.")
@@ -424,7 +451,7 @@ class Compositor3:
                 }
                 return {
                     "ui": ui,
-                    "result": (fabricData, image, empty_output)
+                    "result": (fabricData, image, empty_output, {"layers": [], "variants": 0})
                 }
             except Exception as e:
                 print(f"An unexpected error occurred during image processing: {e}")
@@ -437,5 +464,5 @@ class Compositor3:
                 }
                 return {
                     "ui": ui,
-                    "result": (fabricData, image, empty_output)
+                    "result": (fabricData, image, empty_output, {"layers": [], "variants": 0})
                 }
\ No newline at end of file
@@ -0,0 +1,221 @@
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+import torch
+from aiohttp import web
+from PIL import Image
+
+# every cache registers here so their counters can be inspected from a single route
+cache_registry = {}
+
+# id(tensor) -> (weak reference, tensor version, fingerprint)
+_fingerprints = {}
+
+
+def fingerprint_tensor(tensor):
+    """
+    Content fingerprint of a tensor (shape, dtype and a blake2b digest of the data).
+    The digest is memoized per tensor object and invalidated by in-place writes,
+    so passing the same cached upstream output again costs a dict lookup.
+
+    Parameters:
+    - tensor: Torch tensor or None
+
+    Returns:
+    - Hashable fingerprint, None for None
+    """
+    if tensor is None:
+        return None
+
+    key = id(tensor)
+    entry = _fingerprints.get(key)
+    if entry is not None and entry[0]() is tensor and entry[1] == tensor._version:
+        return entry[2]
+
+    data = tensor.detach().cpu().contiguous().numpy()
+    digest = hashlib.blake2b(data.tobytes(), digest_size=16).hexdigest()
+    fingerprint = (tuple(tensor.shape), str(tensor.dtype), digest)
+    try:
+        ref = weakref.ref(tensor, lambda _ref, key=key: _fingerprints.pop(key, None))
+        _fingerprints[key] = (ref, tensor._version, fingerprint)
+    except TypeError:
+        # not weak referenceable, just don't memoize
+        pass
+    return fingerprint
+
+
+def sizeof(value):
+    """Approximate memory held by a cached value (tensors, arrays, bytes and containers of them)"""
+    if value is None:
+        return 0
+    if isinstance(value, torch.Tensor):
+        return value.element_size() * value.nelement()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return sum(sizeof(v) for v in value.values())
+    return 0
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by the memory held by its values.
+    Least recently used entries are evicted once max_bytes (or max_entries) is exceeded,
+    a max_bytes of 0 disables caching.
+    """
+
+    def __init__(self, name, max_bytes=512 * 1024 * 1024, max_entries=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        cache_registry[name] = self
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """lookup that doesn't touch the counters or the eviction order"""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry[0] if entry is not None else default
+
+    def put(self, key, value):
+        size = sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            # a value that can never fit would just flush everything else
+            if size > self.max_bytes:
+                return value
+            self.entries[key] = (value, size)
+            self.bytes += size
+            self._evict()
+        return value
+
+    def resize(self, max_bytes=None, max_entries=None):
+        with self.lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if max_entries is not None:
+                self.max_entries = max_entries
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _evict(self):
+        while self.entries and (self.bytes > self.max_bytes or
+                                (self.max_entries is not None and len(self.entries) > self.max_entries)):
+            _, (_, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+
+class PreviewStore(LRUCache):
+    """
+    LRUCache of encoded previews, (bytes, mime type, (width, height)) by hex digest, written
+    through to a directory. Evicting an entry only frees memory: the url handed to the browser
+    keeps working, the bytes are read back from disk on the next lookup.
+    """
+
+    extensions = {"image/png": "png", "image/webp": "webp"}
+
+    def __init__(self, name, directory, max_bytes=512 * 1024 * 1024, max_entries=None):
+        super().__init__(name, max_bytes, max_entries)
+        self.directory = directory
+
+    def get(self, key, default=None):
+        value = super().get(key)
+        if value is None:
+            value = self._load(key)
+        return default if value is None else value
+
+    def peek(self, key, default=None):
+        value = super().peek(key)
+        if value is None:
+            value = self._load(key)
+        return default if value is None else value
+
+    def put(self, key, value):
+        data, content_type, _ = value
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{key}.{self.extensions.get(content_type, 'bin')}")
+            if not os.path.exists(path):
+                # written aside and renamed, a concurrent read never sees a partial file
+                temporary = f"{path}.{threading.get_ident()}.tmp"
+                with open(temporary, "wb") as file:
+                    file.write(data)
+                os.replace(temporary, path)
+        except OSError as e:
+            print(f"{self.name}: could not persist preview {key}: {e}")
+        return super().put(key, value)
+
+    def _load(self, key):
+        # digests come from urls, never let one point outside the directory
+        if not key or any(c not in "0123456789abcdef" for c in key):
+            return None
+        for content_type, extension in self.extensions.items():
+            path = os.path.join(self.directory, f"{key}.{extension}")
+            try:
+                with open(path, "rb") as file:
+                    data = file.read()
+            except OSError:
+                continue
+            with Image.open(BytesIO(data)) as image:
+                size = image.size
+            return super().put(key, (data, content_type, size))
+        return None
+
+
+async def serve_preview(request, cache):
+    """
+    Response of a content addressed preview route ({digest} in the path) from a cache of
+    (bytes, mime type, size) entries. The url never changes meaning, so the browser can keep
+    the preview for good and revalidate it with the etag.
+    """
+    digest = request.match_info["digest"]
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers=headers)
+    encoded = cache.peek(digest)
+    if encoded is None:
+        return web.Response(status=404)
+    data, content_type, _ = encoded
+    return web.Response(body=data, content_type=content_type, headers=headers)
@@ -1,33 +1,38 @@
 import nodes
-import numpy as np
-import base64
-from io import BytesIO
 from PIL import Image
 import folder_paths
+import hashlib
+import json
+import os
 import torch
-import torch.nn.functional as F
 import math
 from comfy.utils import common_upscale
+from server import PromptServer
+from .CompositorCache import PreviewStore, fingerprint_tensor, serve_preview
+from .CompositorImageOps import encode_preview, normalize_height
 
 MAX_RESOLUTION = nodes.MAX_RESOLUTION
 
 
-# these probably exist elsewhere as utils
-def tensor2pil(image):
-    return Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
-
-
-# these probably exist elsewhere as utils
-def toBase64ImgUrl(img):
-    bytesIO = BytesIO()
-    img.save(bytesIO, format="PNG")
-    img_types = bytesIO.getvalue()
-    img_base64 = base64.b64encode(img_types)
-    return f"data:image/png;base64,{img_base64.decode('utf-8')}"
+def config_fingerprint(config):
+    """digest of the config dict (previews are referenced by content urls, so images are covered too)"""
+    serialized = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.blake2b(serialized.encode("utf-8"), digest_size=16).hexdigest()
 
 
 class CompositorConfig3:
-    NOT_IDEMPOTENT = True
+    # encoded layer previews (png bytes) by content digest, served on /compositor/preview/{digest}
+    # re-runs with unchanged inputs skip the encoding and send the same short url,
+    # the bytes are kept in the temp directory so urls outlive the in-memory entries
+    preview_cache = PreviewStore("compositor_previews", os.path.join(folder_paths.get_temp_directory(), "compositor_previews"), max_bytes=256 * 1024 * 1024)
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        # deterministic, so unchanged configs are served from the execution cache.
+        # comfy only passes the widget values here, linked images and masks are covered by its
+        # cache key of the upstream nodes; the "initialized" timestamp the ui resets on workflow
+        # load still forces a run so the compositor gets its previews again
+        return hashlib.blake2b(repr(sorted(kwargs.items())).encode("utf-8"), digest_size=16).hexdigest()
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -58,6 +63,13 @@ class CompositorConfig3:
                 "mask7": ("MASK",),
                 "image8": ("IMAGE",),
                 "mask8": ("MASK",),
+                "placement": (["pil", "torch"], {"default": "pil"}),
+                "render": (["browser", "server"], {"default": "browser"}),
+                "layerCacheMB": ("INT", {"default": 512, "min": 0, "max": 65536, "step": 64}),
+                "continueMode": (["requeue", "await"], {"default": "requeue"}),
+                "awaitTimeout": ("INT", {"default": 300, "min": 1, "max": 86400, "step": 1}),
+                "layerWorkers": ("INT", {"default": 1, "min": 1, "max": 8, "step": 1}),
+                "preview": (["png", "proxy png", "proxy webp"], {"default": "png"}),
             },
             "hidden": {
                 "prompt": "PROMPT",
@@ -79,6 +91,12 @@ The compositor node
 - masks are automatically applied and internally the compositor is passed an rgba
 - use the sizing controls to configure the compositor, it will be resized on run
 - set the flag to pause to allow yourself time to build your composition (pause acts on compositor, not the config node)
+- placement selects how layer outputs are positioned: pil (original) or torch (single affine resample, faster on big canvases)
+- render server composes the image in python from the stored transforms, no browser needed (batch queues)
+- layerCacheMB caps the memory used to reuse positioned layers that did not change between runs (0 disables it)
+- continueMode await keeps the compositor waiting (up to awaitTimeout seconds) for your composition instead of re-enqueueing the prompt
+- layerWorkers > 1 positions the layers in parallel threads
+- preview proxy png / proxy webp sends the ui layers downsampled to the canvas size with faster encoders, outputs stay full resolution
 """
 
     def configure(self, **kwargs):
@@ -113,49 +131,61 @@ The compositor node
         normalizeHeight = kwargs.pop('normalizeHeight', 512)
         # grabAndContinue, stop
         onConfigChanged = kwargs.pop('onConfigChanged', False)
+        # pil: legacy per layer PIL round trips, torch: single affine resample on tensors
+        placement = kwargs.pop('placement', "pil")
+        # browser: wait for the fabric canvas upload, server: headless compositing in python
+        render = kwargs.pop('render', "browser")
+        # memory cap of the positioned layers cache in the compositor, 0 disables it
+        layerCacheMB = kwargs.pop('layerCacheMB', 512)
+        # requeue: the browser re-enqueues the prompt after uploading, await: the compositor waits for the upload
+        continueMode = kwargs.pop('continueMode', "requeue")
+        awaitTimeout = kwargs.pop('awaitTimeout', 300)
+        # threads used by the compositor to position layers, 1 keeps the sequential loop
+        layerWorkers = kwargs.pop('layerWorkers', 1)
+        # png: full resolution lossless png, proxy *: downsampled to fit the canvas, fast encoders
+        preview = kwargs.pop('preview', "png")
         node_id = kwargs.pop('node_id', None)
 
         images = [image1, image2, image3, image4, image5, image6, image7, image8, ]
         masks = [mask1, mask2, mask3, mask4, mask5, mask6, mask7, mask8, ]
         input_images = []
+        # preview size / layer size, the ui transforms are relative to the preview
+        preview_scales = []
+        proxy_size = (width, height) if preview != "png" else None
+
+        # previews are content addressed, find the ones that need to be (re)encoded
+        digests = [None] * 8
+        encoded_previews = [None] * 8
+        missing = []
+        for index, (img, mask) in enumerate(zip(images, masks)):
+            if img is not None:
+                cache_key = (fingerprint_tensor(img), fingerprint_tensor(mask), invertMask, height if normalizeHeight else None, preview, proxy_size)
+                digests[index] = hashlib.blake2b(repr(cache_key).encode("utf-8"), digest_size=16).hexdigest()
+                encoded_previews[index] = self.preview_cache.get(digests[index])
+                if encoded_previews[index] is None:
+                    missing.append(index)
+
+        # resize all the layers to encode, and their masks, in one grouped pass
+        # the ui shows the first frame of a sequence, only that one is prepared
+        missing_images = [images[index][:1] for index in missing]
+        missing_masks = [masks[index].reshape((-1,) + masks[index].shape[-2:])[:1] if masks[index] is not None else None for index in missing]
+        if normalizeHeight and missing:
+            missing_images, missing_masks = normalize_height(missing_images, missing_masks, height)
 
         # apply the masks to the images if any so that we get a rgba
-        # then pass the rgba in the return value
-        counter = 0
-        for (img, mask) in zip(images, masks):
-            if img is not None:
+        for index, img, mask in zip(missing, missing_images, missing_masks):
+            encoded_previews[index] = self.preview_cache.put(digests[index], encode_preview(img, mask, invertMask, preview, proxy_size))
 
-                if normalizeHeight:
-                    # print(counter)
-                    counter = counter+1
-                    #img = self.upscale(img, "lanczos", height, "height", "disabled")
-                    processor = ImageProcessor()
-                    oldimg = img
-                    img = processor.scale_image(img, height)
-                    #print(oldimg == img)
-                # tensor
-
-                if mask is not None:
-                    # if normalizeHeight:
-                    #     # print(mask)
-                    #     #mask = self.upscale(img, "lanczos", height, "height", "disabled")
-                    #     mask = prepare_mask(mask, foo_is_batch=True)
-                    #     mask = processor.scale_image(mask, height)
-
-                    # apply the mask and return
-                    # apply the mask and return
-                    masked = self.apply_mask(img, mask, invertMask)
-                    # self.masked = masked[0]
-
-                    i = tensor2pil(masked[0])
-                    input_images.append(toBase64ImgUrl(i))
-                else:
-                    # no need to apply the mask
-                    i = tensor2pil(img)
-                    input_images.append(toBase64ImgUrl(i))
+        for (img, digest, encoded) in zip(images, digests, encoded_previews):
+            if img is not None:
+                # the ui fetches the image, only this url travels in the websocket message and history
+                input_images.append(f"/compositor/preview/{digest}")
+                preview_width, preview_height = encoded[2]
+                preview_scales.append((preview_width / img.shape[2], preview_height / img.shape[1]))
             else:
                 # input is None, forward
                 input_images.append(img)
+                preview_scales.append(None)
 
         self.ensureEmpty()
 
@@ -168,24 +198,19 @@ The compositor node
             "onConfigChanged": onConfigChanged,
             "normalizeHeight": normalizeHeight,
             "invertMask": invertMask,
-        }        
+            "placement": placement,
+            "render": render,
+            "layerCacheMB": layerCacheMB,
+            "continueMode": continueMode,
+            "awaitTimeout": awaitTimeout,
+            "layerWorkers": layerWorkers,
+            "preview": preview,
+            "previewScales": preview_scales,
+        }
+        # computed once here so the compositor detects changes with a single comparison
+        res["fingerprint"] = config_fingerprint(res)        
         return (res, all_inputs)
 
-    def apply_mask(self, image: torch.Tensor, alpha: torch.Tensor, invertMask=False):
-        batch_size = min(len(image), len(alpha))
-        out_images = []
-
-        if invertMask:
-            alpha = 1.0 - resize_mask(alpha, image.shape[1:])
-        else:
-            alpha = resize_mask(alpha, image.shape[1:])
-
-        for i in range(batch_size):
-            out_images.append(torch.cat((image[i][:, :, :3], alpha[i].unsqueeze(2)), dim=2))
-
-        result = (torch.stack(out_images),)
-        return result
-
     # ensures empty.png exists
     def ensureEmpty(self):
         image = "test_empty.png"
@@ -245,37 +270,6 @@ def get_image_size(IMAGE) -> tuple[int, int]:
     return size
 
 
-def resize_mask(mask, shape):
-    return torch.nn.functional.interpolate(mask.reshape((-1, 1, mask.shape[-2], mask.shape[-1])),
-                                           size=(shape[0], shape[1]), mode="bilinear").squeeze(1)
-
-class ImageProcessor:
-    def scale_image(self, image_tensor, new_height):
-        # Ensure the input tensor is in the format [batch_size, height, width, channels]
-        if image_tensor.ndim != 4:
-            raise ValueError("Expected image tensor to have shape [batch_size, height, width, channels]")
-
-        batch_size, original_height, original_width, channels = image_tensor.shape
-
-        if channels not in (1, 3, 4):
-            raise ValueError("Image tensor must have 1 (grayscale), 3 (RGB), or 4 (RGBA) channels")
-
-        # Calculate the new width to maintain the aspect ratio
-        aspect_ratio = original_width / original_height
-        new_width = int(new_height * aspect_ratio)
-
-        # Permute to match PyTorch's expected format [batch_size, channels, height, width]
-        image_tensor = image_tensor.permute(0, 3, 1, 2)  # [batch_size, channels, height, width]
-
-        # Resize images to the new dimensions (new_height, new_width)
-        resized_images = F.interpolate(image_tensor, size=(new_height, new_width), mode='bilinear', align_corners=False)
-
-        # Permute back to the original format [batch_size, height, width, channels]
-        resized_images = resized_images.permute(0, 2, 3, 1)  # [batch_size, height, width, channels]
-
-        return resized_images
-
-
 def prepare_mask(mask, foo_is_batch):
     """
     Prepares the mask tensor to have shape [batch_size, height, width, channels].
@@ -291,4 +285,10 @@ def prepare_mask(mask, foo_is_batch):
         # Case where `foo` is the channel dimension, reshape to [1, height, width, channels]
         mask = mask.unsqueeze(0).permute(0, 2, 3, 1)  # Add batch dim and permute to [1, height, width, channels]
 
-    return mask
\ No newline at end of file
+    return mask
+
+
+# previews are content addressed, so the browser can cache them for good and revalidate with the etag
+@PromptServer.instance.routes.get('/compositor/preview/{digest}')
+async def compositorPreview(request):
+    return await serve_preview(request, CompositorConfig3.preview_cache)
@@ -0,0 +1,116 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from io import BytesIO
+from PIL import Image
+
+# image operations of CompositorConfig3, torch, PIL and numpy only so they can be tested without ComfyUI
+
+
+def tensor2pil(image):
+    return Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
+
+
+def toPngBytes(img, compress_level=6):
+    bytesIO = BytesIO()
+    img.save(bytesIO, format="PNG", compress_level=compress_level)
+    return bytesIO.getvalue()
+
+
+def toWebpBytes(img):
+    bytesIO = BytesIO()
+    # lossless with the fastest method, previews only need to be quick to produce
+    img.save(bytesIO, format="WEBP", lossless=True, quality=0, method=0)
+    return bytesIO.getvalue()
+
+
+def encode_preview(img, mask, invertMask, preview="png", proxy_size=None):
+    """
+    the image the compositor ui shows for a layer, with the mask applied as alpha
+    with a proxy_size the layer is downsampled to fit in it (display resolution)
+    returns (bytes, mime type, (width, height))
+    """
+    if mask is not None:
+        # apply the mask and return
+        masked = apply_mask(img, mask, invertMask)
+        i = tensor2pil(masked)
+    else:
+        # no need to apply the mask
+        i = tensor2pil(img)
+
+    if proxy_size is not None:
+        factor = min(1.0, proxy_size[0] / i.width, proxy_size[1] / i.height)
+        if factor < 1.0:
+            proxy = (max(1, round(i.width * factor)), max(1, round(i.height * factor)))
+            i = i.resize(proxy, Image.Resampling.BILINEAR, reducing_gap=2.0)
+
+    if preview == "proxy webp":
+        return toWebpBytes(i), "image/webp", i.size
+    if preview == "proxy png":
+        return toPngBytes(i, compress_level=1), "image/png", i.size
+    return toPngBytes(i), "image/png", i.size
+
+
+def apply_mask(image: torch.Tensor, alpha: torch.Tensor, invertMask=False):
+    alpha = resize_mask(alpha, image.shape[1:]).to(device=image.device, dtype=image.dtype)
+    if invertMask:
+        alpha = 1.0 - alpha
+
+    # a single mask applies to every frame, otherwise frames pair up with masks
+    if len(alpha) == 1:
+        batch_size = len(image)
+        alpha = alpha.expand(batch_size, -1, -1)
+    else:
+        batch_size = min(len(image), len(alpha))
+
+    # the whole batch is assembled into RGBA in one go
+    return torch.cat((image[:batch_size, :, :, :3], alpha[:batch_size].unsqueeze(-1)), dim=-1)
+
+
+def resize_mask(mask, shape):
+    # nothing to resample when the mask already matches
+    if tuple(mask.shape[-2:]) == (shape[0], shape[1]):
+        return mask.reshape((-1, mask.shape[-2], mask.shape[-1]))
+    return F.interpolate(mask.reshape((-1, 1, mask.shape[-2], mask.shape[-1])),
+                         size=(shape[0], shape[1]), mode="bilinear").squeeze(1)
+
+
+def resize_layers(tensors, sizes, antialias=False):
+    """
+    Bilinear resize of a list of [B, H, W, C] tensors to their target (height, width).
+    Each tensor is resized on its own channels-last view: concatenating them into one call
+    copies every layer to a contiguous NCHW batch, which costs more than the resize itself on CPU.
+    Inputs already at their target size are returned as is. antialias filters downscaling,
+    it reads every source pixel and is several times slower on CPU.
+    """
+    results = []
+    for tensor, size in zip(tensors, sizes):
+        if tuple(tensor.shape[1:3]) == tuple(size):
+            results.append(tensor)
+            continue
+        downscale = size[0] < tensor.shape[1] or size[1] < tensor.shape[2]
+        resized = F.interpolate(tensor.movedim(-1, 1), size=size, mode="bilinear", align_corners=False,
+                                antialias=antialias and downscale)
+        results.append(resized.movedim(1, -1))
+    return results
+
+
+def normalize_height(images, masks, new_height, antialias=False):
+    """
+    Resize layers to new_height keeping their aspect ratio (width truncated to an int),
+    with each mask resized straight to its image's new size so apply_mask has nothing left to stretch.
+
+    images: list of [B, H, W, C] tensors, masks: list of [B, H, W] tensors or None
+    returns (resized images, resized masks)
+    """
+    sizes = [(new_height, int(new_height * (img.shape[2] / img.shape[1]))) for img in images]
+    resized_images = resize_layers(images, sizes, antialias)
+
+    mask_indexes = [index for index, mask in enumerate(masks) if mask is not None]
+    resized_masks = list(masks)
+    resized = resize_layers([masks[index].reshape((-1,) + masks[index].shape[-2:] + (1,)) for index in mask_indexes],
+                            [sizes[index] for index in mask_indexes], antialias)
+    for index, mask in zip(mask_indexes, resized):
+        resized_masks[index] = mask.squeeze(-1)
+
+    return resized_images, resized_masks
@@ -0,0 +1,741 @@
+from PIL import Image, ImageOps
+import numpy as np
+import torch
+import torch.nn.functional as F
+import math
+from concurrent.futures import ThreadPoolExecutor
+from .CompositorMasksOutputV3 import match_frames
+
+# layer placement of Compositor3 (rotation, scaling, positioning and compositing of the layers),
+# torch, PIL and numpy only so it can be tested without ComfyUI
+
+# Helper functions (assuming these are standard ComfyUI tensor/PIL conversions)
+def tensor2pil(image: torch.Tensor) -> Image.Image:
+    return Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(0), 0, 255).astype(np.uint8))
+
+def pil2tensor(image: Image.Image) -> torch.Tensor:
+    return torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
+
+# Function to create an empty mask tensor of specified dimensions
+def create_empty_mask(width, height, inverted=False):
+    """
+    Create an empty mask tensor with specified dimensions.
+    
+    Parameters:
+    - width: Width of the mask
+    - height: Height of the mask
+    - inverted: If True, creates a white mask (all 255), otherwise black mask (all 0)
+    
+    Returns:
+    - Tensor representing an empty mask
+    """
+    try:
+        # Create a black image (all zeros) or white image (all 255) of the specified dimensions
+        value = 255 if inverted else 0
+        empty_mask = Image.new('L', (width, height), value)
+        # Convert to tensor
+        return pil2tensor(empty_mask)
+    except Exception as e:
+        print(f"Error creating empty mask: {e}")
+        # As a fallback, create a 1x1 pixel mask
+        value = 255 if inverted else 0
+        fallback_mask = Image.new('L', (1, 1), value)
+        return pil2tensor(fallback_mask)
+
+# Add a new helper function for placing images on a canvas with proper positioning
+def place_on_canvas(image_tensor, canvas_width, canvas_height, left, top, scale_x=1.0, scale_y=1.0, mask_tensor=None, invert_mask=True):
+    """
+    Place an image tensor on a canvas of specified dimensions at the given position.
+    Images exceeding canvas boundaries will be truncated.
+    Preserves transparency of original image and ensures areas not covered by image are transparent.
+    
+    Parameters:
+    - image_tensor: Torch tensor image to place
+    - canvas_width, canvas_height: Dimensions of the target canvas
+    - left, top: Position to place the image (top-left corner)
+    - scale_x, scale_y: Optional scaling factors
+    - mask_tensor: Optional mask tensor to apply to the image
+    - invert_mask: Whether to invert the final mask (True means white=masked, black=unmasked)
+    
+    Returns:
+    - Tuple of (positioned image tensor, positioned mask tensor)
+    """
+    if image_tensor is None:
+        return None, None
+        
+    try:
+        # Convert tensor to PIL for manipulation
+        pil_image = tensor2pil(image_tensor)
+        
+        # Convert to RGBA to preserve transparency
+        if pil_image.mode != 'RGBA':
+            pil_image = pil_image.convert('RGBA')
+            
+        # Create alpha channel if not already present
+        if len(pil_image.split()) < 4:
+            r, g, b = pil_image.split()
+            alpha = Image.new('L', pil_image.size, 255)  # Start with fully opaque
+            pil_image = Image.merge('RGBA', (r, g, b, alpha))
+            
+        # Convert mask tensor to PIL if provided
+        pil_mask = None
+        if mask_tensor is not None:
+            pil_mask = tensor2pil(mask_tensor)
+            # Convert to grayscale if it's not already
+            if pil_mask.mode != 'L':
+                pil_mask = pil_mask.convert('L')
+        
+        # Apply scaling if needed (different from 1.0)
+        original_width, original_height = pil_image.size
+        if scale_x != 1.0 or scale_y != 1.0:
+            new_width = max(1, int(original_width * scale_x))
+            new_height = max(1, int(original_height * scale_y))
+            if new_width > 0 and new_height > 0:  # Ensure dimensions are valid
+                pil_image = pil_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                if pil_mask is not None:
+                    pil_mask = pil_mask.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        
+        # Create a transparent canvas for the image (RGBA with alpha=0)
+        canvas = Image.new('RGBA', (canvas_width, canvas_height), (0, 0, 0, 0))
+        
+        # Create a mask canvas - start with fully masked (255 for inverted masks)
+        # This ensures anything outside the bounding box is considered masked
+        mask_canvas = Image.new('L', (canvas_width, canvas_height), 255 if invert_mask else 0)
+        
+        # Calculate position with integer precision
+        pos_left = int(left)
+        pos_top = int(top)
+        
+        # Paste the image onto the canvas with transparency
+        # PIL will handle truncation automatically when the image extends beyond canvas boundaries
+        canvas.paste(pil_image, (pos_left, pos_top), pil_image.split()[3])  # Use alpha channel as mask
+        
+        # Get the dimensions of the placed image
+        placed_width = min(pil_image.width, canvas_width - pos_left) if pos_left < canvas_width else 0
+        placed_height = min(pil_image.height, canvas_height - pos_top) if pos_top < canvas_height else 0
+        
+        # Create a bounding box mask (black inside bounding box, white outside)
+        if placed_width > 0 and placed_height > 0:
+            # For the area where the image is placed, we need to:
+            # - If invert_mask=False: Set to 0 (unmasked) where image exists
+            # - If invert_mask=True: Set to 0 (masked) where image exists
+            bbox_value = 0
+            
+            # Create a temporary mask for the bounding box area
+            bbox_rect = Image.new('L', (placed_width, placed_height), bbox_value)
+            
+            # Paste this rectangle onto our mask canvas at the image position
+            # For inverted masks, this means the area where the image will be placed starts as unmasked (0)
+            # and the rest of the canvas is masked (255)
+            mask_canvas.paste(bbox_rect, (pos_left, pos_top))
+        
+        # Process the input mask if provided
+        if pil_mask is not None:
+            # Create a temporary transparent canvas for the input mask
+            input_mask_canvas = Image.new('L', (canvas_width, canvas_height), 0)
+            
+            # Paste the input mask at the correct position
+            input_mask_canvas.paste(pil_mask, (pos_left, pos_top))
+            
+            # If we're using inverted masks, we need to invert the input mask before combining
+            if invert_mask:
+                input_mask_canvas = ImageOps.invert(input_mask_canvas)
+            
+            # Now combine with our bounding box mask
+            # For inverted masks, we use the minimum value (logical AND) 
+            # This ensures that:
+            # - Areas outside bbox are always masked (255 for inverted)
+            # - Areas inside bbox are masked according to input mask
+            mask_array = np.array(mask_canvas)
+            input_mask_array = np.array(input_mask_canvas)
+            
+            if invert_mask:
+                # For inverted masks: black=unmasked (0), white=masked (255)
+                # Take the maximum value at each point (logical OR)
+                combined_array = np.maximum(mask_array, input_mask_array)
+            else:
+                # For normal masks: white=unmasked (255), black=masked (0)
+                # Take the minimum value at each point (logical AND)
+                combined_array = np.minimum(mask_array, input_mask_array)
+            
+            # Convert back to PIL
+            mask_canvas = Image.fromarray(combined_array.astype(np.uint8))
+        
+        # Convert back to tensor - need to handle RGBA to RGB conversion for ComfyUI compatibility
+        # First extract RGB channels and create an RGB image
+        r, g, b, a = canvas.split()
+        rgb_image = Image.merge('RGB', (r, g, b))
+        
+        # Convert back to tensors
+        positioned_image_tensor = pil2tensor(rgb_image)
+        positioned_mask_tensor = pil2tensor(mask_canvas)
+        
+        return positioned_image_tensor, positioned_mask_tensor
+    except Exception as e:
+        print(f"Error placing image on canvas: {e}")
+        return image_tensor, mask_tensor  # Return original on error
+
+
+def rotated_size(width, height, angle):
+    """
+    Size of the bounding box PIL produces for image.rotate(-angle, expand=True).
+
+    Parameters:
+    - width, height: Size of the unrotated image
+    - angle: Clockwise rotation in degrees (fabric convention)
+
+    Returns:
+    - Tuple of (expanded width, expanded height)
+    """
+    # the angle PIL receives, normalized the way Image.rotate does it
+    angle = -angle % 360.0
+    if angle in (0, 180):
+        return width, height
+    if angle in (90, 270):
+        # PIL transposes instead of resampling, so the size is swapped exactly
+        return height, width
+
+    # same corner projection PIL uses for expand=True
+    radians = -math.radians(angle)
+    cos_a = round(math.cos(radians), 15)
+    sin_a = round(math.sin(radians), 15)
+    xx = []
+    yy = []
+    for x, y in ((0, 0), (width, 0), (width, height), (0, height)):
+        x -= width / 2.0
+        y -= height / 2.0
+        xx.append(cos_a * x + sin_a * y + width / 2.0)
+        yy.append(-sin_a * x + cos_a * y + height / 2.0)
+    return math.ceil(max(xx)) - math.floor(min(xx)), math.ceil(max(yy)) - math.floor(min(yy))
+
+
+def rotate_and_scale(pil_image, angle, scale_x=1.0, scale_y=1.0):
+    """
+    Rotate (with expand) and scale a PIL image so that the result has the size of
+    "rotate at full resolution, then resize the expanded bbox by scale_x/scale_y",
+    while doing the rotation at the target resolution.
+
+    The source is first decimated with LANCZOS to twice the target scale, so a 6000px photo
+    placed at scale 0.15 is rotated at ~1800px instead of 6000px. The rotation samples the
+    decimated image onto a 2x grid of the full resolution expanded bbox, which LANCZOS then
+    brings to the target: rotating the decimated image with expand=True would round its own
+    bbox up and leave a dark 1px frame, sampling at the target size would alias the edges.
+
+    Parameters:
+    - pil_image: PIL image (RGB or L)
+    - angle: Clockwise rotation in degrees (fabric convention)
+    - scale_x, scale_y: Scaling factors applied to the rotated bounding box
+
+    Returns:
+    - The rotated and scaled PIL image
+    """
+    width, height = pil_image.size
+    expanded_width, expanded_height = rotated_size(width, height, angle)
+    target_width = max(1, int(expanded_width * scale_x))
+    target_height = max(1, int(expanded_height * scale_y))
+
+    decimation = max(target_width / expanded_width, target_height / expanded_height)
+    if decimation >= 1.0 or angle % 90 == 0:
+        # nothing to decimate, or a transpose that keeps the geometry exact at any size
+        if decimation < 1.0:
+            decimated_size = (max(1, round(width * decimation)), max(1, round(height * decimation)))
+            pil_image = pil_image.resize(decimated_size, Image.Resampling.LANCZOS)
+        if angle % 360 != 0:
+            pil_image = pil_image.rotate(-angle, expand=True, resample=Image.Resampling.BILINEAR)
+        if pil_image.size != (target_width, target_height):
+            pil_image = pil_image.resize((target_width, target_height), Image.Resampling.LANCZOS)
+        return pil_image
+
+    # rotate on a grid twice the target size, capped to the full resolution bbox
+    grid_width, grid_height = min(expanded_width, 2 * target_width), min(expanded_height, 2 * target_height)
+    decimation = min(1.0, 2 * decimation)
+    if decimation < 1.0:
+        pil_image = pil_image.resize((max(1, round(width * decimation)), max(1, round(height * decimation))), Image.Resampling.LANCZOS)
+
+    # PIL's expand=True rotation matrix (grid pixel -> source pixel), with the grid scaled
+    # to the expanded bbox and the source scaled to the decimated image
+    radians = -math.radians(-angle % 360.0)
+    cos_a = round(math.cos(radians), 15)
+    sin_a = round(math.sin(radians), 15)
+    source_x, source_y = pil_image.width / width, pil_image.height / height
+    step_x, step_y = expanded_width / grid_width, expanded_height / grid_height
+    matrix = (
+        source_x * cos_a * step_x,
+        source_x * sin_a * step_y,
+        source_x * (width / 2.0 - cos_a * expanded_width / 2.0 - sin_a * expanded_height / 2.0),
+        -source_y * sin_a * step_x,
+        source_y * cos_a * step_y,
+        source_y * (height / 2.0 + sin_a * expanded_width / 2.0 - cos_a * expanded_height / 2.0),
+    )
+    pil_image = pil_image.transform((grid_width, grid_height), Image.Transform.AFFINE, matrix,
+                                    resample=Image.Resampling.BILINEAR)
+    if pil_image.size != (target_width, target_height):
+        pil_image = pil_image.resize((target_width, target_height), Image.Resampling.LANCZOS)
+    return pil_image
+
+
+def frame_value(value, index):
+    """Value of a layer parameter at a frame, per-frame sequences hold their last value"""
+    if isinstance(value, (list, tuple)):
+        return value[min(index, len(value) - 1)]
+    return value
+
+
+def offset(value, delta):
+    """Shift a layer parameter, a number or a per-frame sequence"""
+    if isinstance(value, (list, tuple)):
+        return tuple(v + delta for v in value)
+    return value + delta
+
+
+def layer_affines(src_width, src_height, lefts, tops, angles, scale_xs, scale_ys):
+    """
+    Affine matrices mapping canvas pixel coordinates to normalized grid_sample source
+    coordinates, one per frame: each frame's rotated (PIL-like expand) bounding box is
+    scaled and its top-left corner placed at the integer position, like place_on_canvas does.
+
+    Parameters:
+    - src_width, src_height: Size of the source layer
+    - lefts, tops, angles, scale_xs, scale_ys: Per-frame sequences of the layer parameters
+
+    Returns:
+    - Tuple of (theta [F, 2, 3] float64 tensor, list of per-frame (left, top, width, height, decimation))
+    """
+    boxes = []
+    for left, top, angle, scale_x, scale_y in zip(lefts, tops, angles, scale_xs, scale_ys):
+        expanded_width, expanded_height = rotated_size(src_width, src_height, angle)
+        target_width = max(1, int(expanded_width * scale_x))
+        target_height = max(1, int(expanded_height * scale_y))
+        decimation = max(target_width / expanded_width, target_height / expanded_height)
+        boxes.append((int(left), int(top), target_width, target_height, expanded_width, expanded_height, decimation))
+
+    b = torch.tensor([box[:6] for box in boxes], dtype=torch.float64)
+    pos_left, pos_top, target_width, target_height, expanded_width, expanded_height = b.unbind(1)
+    radians = torch.deg2rad(torch.tensor(angles, dtype=torch.float64))
+    cos_a, sin_a = torch.cos(radians), torch.sin(radians)
+
+    # canvas pixel -> bbox (scaled back to the expanded bbox, centered) -> inverse rotation -> normalized source
+    kx = expanded_width / target_width
+    ky = expanded_height / target_height
+    ox = kx * pos_left + expanded_width / 2
+    oy = ky * pos_top + expanded_height / 2
+    theta = torch.stack((
+        torch.stack((cos_a * kx, sin_a * ky, -(cos_a * ox + sin_a * oy)), dim=1) * (2 / src_width),
+        torch.stack((-sin_a * kx, cos_a * ky, sin_a * ox - cos_a * oy), dim=1) * (2 / src_height),
+    ), dim=1)
+    return theta, [(box[0], box[1], box[2], box[3], box[6]) for box in boxes]
+
+
+# Tensor-native counterpart of place_on_canvas: rotation, scaling and translation are folded
+# into a single affine resample and only the visible part of the destination bbox is computed
+def place_on_canvas_torch(image_tensor, canvas_width, canvas_height, left, top, scale_x=1.0, scale_y=1.0, mask_tensor=None, invert_mask=True, angle=0):
+    """
+    Place an image tensor on a canvas without going through PIL.
+    Rotation (with PIL-like expand), scaling and translation are applied as one affine
+    grid_sample on the image and its mask together, writing only into the destination bbox.
+    Every frame of a batch is placed in that single resample, with the same transform
+    or, for keyframed layers, with its own affine matrix.
+
+    Parameters:
+    - image_tensor: Torch tensor image to place [B, H, W, C]
+    - canvas_width, canvas_height: Dimensions of the target canvas
+    - left, top: Position of the top-left corner of the rotated bounding box
+    - scale_x, scale_y: Scaling factors applied to the rotated bounding box
+    - mask_tensor: Optional mask tensor to apply to the image, a single mask applies to every frame
+    - invert_mask: Whether to invert the final mask (True means white=masked, black=unmasked)
+    - angle: Clockwise rotation in degrees (fabric convention)
+    left, top, scale_x, scale_y and angle are numbers or per-frame sequences (keyframed layers)
+
+    Returns:
+    - Tuple of (positioned image tensor, positioned mask tensor), same contract as place_on_canvas
+      with one frame per input frame (or per transform frame when there are more)
+    """
+    if image_tensor is None:
+        return None, None
+
+    try:
+        image = image_tensor if image_tensor.ndim == 4 else image_tensor.unsqueeze(0)
+        image = image.float()
+        batch_size, src_height, src_width, channels = image.shape
+        device = image.device
+
+        # one set of parameters per frame, a static layer has a single one
+        parameters = (left, top, angle, scale_x, scale_y)
+        frames = max([len(value) for value in parameters if isinstance(value, (list, tuple))], default=1)
+        theta, boxes = layer_affines(src_width, src_height, *[[frame_value(value, i) for i in range(frames)] for value in parameters])
+        batch_size = max(batch_size, frames)
+
+        has_mask = mask_tensor is not None
+        if has_mask:
+            mask = mask_tensor.reshape((-1, 1, mask_tensor.shape[-2], mask_tensor.shape[-1])).float().to(device)
+            if mask.shape[-2:] != (src_height, src_width):
+                mask = F.interpolate(mask, size=(src_height, src_width), mode="bilinear", align_corners=False)
+            batch_size = max(batch_size, mask.shape[0])
+            mask = match_frames(mask, batch_size)
+        image = match_frames(image, batch_size)
+
+        # [B, C, H, W], rgba inputs are flattened on black like the PIL paste does
+        source = image[..., :3].permute(0, 3, 1, 2)
+        if channels == 4:
+            source = source * image[..., 3:4].permute(0, 3, 1, 2)
+
+        if has_mask:
+            # image and mask travel through the same resample
+            source = torch.cat((source, mask), dim=1)
+
+        positioned_image = torch.zeros((batch_size, canvas_height, canvas_width, 3), dtype=torch.float32, device=device)
+        positioned_mask = torch.full((batch_size, canvas_height, canvas_width), 1.0 if invert_mask else 0.0, dtype=torch.float32, device=device)
+
+        # intersection of the placed bboxes (all frames) with the canvas, nothing else is touched
+        x0 = max(0, min(box[0] for box in boxes))
+        x1 = min(canvas_width, max(box[0] + box[2] for box in boxes))
+        y0 = max(0, min(box[1] for box in boxes))
+        y1 = min(canvas_height, max(box[1] + box[3] for box in boxes))
+        if x1 <= x0 or y1 <= y0:
+            return positioned_image, positioned_mask
+
+        # pre-decimate big sources with an antialiased resize so the bilinear sampling below
+        # never skips source pixels; grid coordinates are normalized so the grid is unaffected
+        decimation = min(1.0, max(box[4] for box in boxes))
+        if decimation < 0.5:
+            decimated_size = (max(1, round(src_height * decimation)), max(1, round(src_width * decimation)))
+            source = F.interpolate(source, size=decimated_size, mode="bilinear", align_corners=False, antialias=True)
+
+        # output pixel centers through each frame's affine matrix, [F, h, w, 2]
+        xs = torch.arange(x0, x1, device=device)
+        ys = torch.arange(y0, y1, device=device).unsqueeze(1)
+        theta = theta.to(device=device, dtype=torch.float32).reshape(frames, 2, 3, 1, 1)
+        grid = torch.stack((
+            theta[:, 0, 0] * (xs + 0.5) + theta[:, 0, 1] * (ys + 0.5) + theta[:, 0, 2],
+            theta[:, 1, 0] * (xs + 0.5) + theta[:, 1, 1] * (ys + 0.5) + theta[:, 1, 2],
+        ), dim=-1)
+
+        # each frame only covers its own bbox within the shared region
+        bounds = torch.tensor([(box[0], box[1], box[0] + box[2], box[1] + box[3]) for box in boxes], device=device).reshape(frames, 4, 1, 1)
+        inside = (xs >= bounds[:, 0]) & (xs < bounds[:, 2]) & (ys >= bounds[:, 1]) & (ys < bounds[:, 3])
+
+        # static layers share one grid, expanded without copying
+        grid = match_frames(grid, batch_size)
+        inside = match_frames(inside, batch_size)
+
+        sampled = F.grid_sample(source, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+        sampled = sampled.clamp(0, 1)
+
+        positioned_image[:, y0:y1, x0:x1, :] = (sampled[:, :3] * inside.unsqueeze(1)).permute(0, 2, 3, 1)
+        # bbox mask: 0 where the image lands, the canvas fill (1 inverted, 0 normal) elsewhere
+        bbox_mask = (~inside).float() * (1.0 if invert_mask else 0.0)
+        if has_mask:
+            # the input mask positioned on an empty canvas, like input_mask_canvas in place_on_canvas
+            input_mask = torch.where(inside, sampled[:, 3], torch.zeros_like(sampled[:, 3]))
+            if invert_mask:
+                # np.maximum of the bbox mask and the inverted input mask (outside the bbox stays masked)
+                positioned_mask[:, y0:y1, x0:x1] = torch.maximum(bbox_mask, 1.0 - input_mask)
+            else:
+                # np.minimum of the bbox mask and the input mask
+                positioned_mask[:, y0:y1, x0:x1] = torch.minimum(bbox_mask, input_mask)
+        else:
+            positioned_mask[:, y0:y1, x0:x1] = bbox_mask
+
+        return positioned_image, positioned_mask
+    except Exception as e:
+        print(f"Error placing image on canvas (torch): {e}")
+        return image_tensor, mask_tensor  # Return original on error
+
+
+def layer_alpha(image_tensor, mask_tensor, invert_mask=False):
+    """
+    Alpha of a layer as the browser preview sees it: the (optionally inverted) mask,
+    or a fully opaque mask when none is given, so rotated corners stay transparent.
+
+    Parameters:
+    - image_tensor: Layer image tensor [B, H, W, C]
+    - mask_tensor: Optional layer mask tensor
+    - invert_mask: The config's invertMask flag
+
+    Returns:
+    - Mask tensor where 1 means opaque
+    """
+    if mask_tensor is None:
+        return torch.ones_like(image_tensor[..., 0])
+    return 1.0 - mask_tensor if invert_mask else mask_tensor
+
+
+def sparse_layer(tensor, fill, left=0, top=0, right=None, bottom=None):
+    """
+    Compact layer representation carried in COMPOSITOR_OUTPUT_MASKS: a tile cropped
+    from a full-canvas tensor, its offset, and the constant value everywhere else.
+    CompositorMasksOutputV3 materializes it back to a full-canvas tensor.
+
+    Parameters:
+    - tensor: Full-canvas tensor [B, H, W, C] or [B, H, W], None for a constant layer
+    - fill: Value of the canvas outside the tile
+    - left, top, right, bottom: Tile bounds on the canvas
+
+    Returns:
+    - Dictionary with 'tile', 'left', 'top' and 'fill'
+    """
+    # clone so the full-canvas storage is not kept alive by the view
+    tile = tensor[:, top:bottom, left:right].clone() if tensor is not None else None
+    return {"tile": tile, "left": left, "top": top, "fill": fill}
+
+
+def crop_layer(image_tensor, mask_tensor, canvas_width, canvas_height, fill=1.0):
+    """
+    Crop a positioned layer and its mask to the area that differs from the empty canvas
+    (black image, mask at 'fill'), materializing the result gives back the same tensors.
+
+    Parameters:
+    - image_tensor: Positioned image tensor [B, H, W, C]
+    - mask_tensor: Positioned mask tensor [B, H, W]
+    - canvas_width, canvas_height: Dimensions of the canvas
+    - fill: Mask value outside the layer bbox
+
+    Returns:
+    - Tuple of (sparse image, sparse mask), or the inputs unchanged when they are not full-canvas
+    """
+    if image_tensor is None or mask_tensor is None:
+        return image_tensor, mask_tensor
+    if image_tensor.shape[1:3] != (canvas_height, canvas_width) or mask_tensor.shape[-2:] != (canvas_height, canvas_width):
+        return image_tensor, mask_tensor
+
+    mask = mask_tensor.reshape((-1, canvas_height, canvas_width))
+    used = (mask != fill).any(dim=0) | (image_tensor != 0).any(dim=-1).any(dim=0)
+    rows = torch.nonzero(used.any(dim=1)).flatten()
+    cols = torch.nonzero(used.any(dim=0)).flatten()
+    if rows.numel() == 0:
+        return sparse_layer(None, 0.0), sparse_layer(None, fill)
+
+    top, bottom = int(rows[0]), int(rows[-1]) + 1
+    left, right = int(cols[0]), int(cols[-1]) + 1
+    return sparse_layer(image_tensor, 0.0, left, top, right, bottom), sparse_layer(mask, fill, left, top, right, bottom)
+
+
+def composite_layers(images, masks, canvas_width, canvas_height):
+    """
+    Blend positioned layers in z-order (image1 at the back, image8 in front)
+    the same way the fabric canvas renders them.
+
+    Parameters:
+    - images: List of positioned layers, sparse or full-canvas tensors (None for missing layers)
+    - masks: List of positioned masks (black=visible, white=transparent)
+    - canvas_width, canvas_height: Dimensions of the output
+
+    Returns:
+    - Composite image tensor [B, H, W, 3], B being the longest layer sequence
+    """
+    batch_size = 1
+    for image in images:
+        tensor = image["tile"] if isinstance(image, dict) else image
+        if tensor is not None:
+            batch_size = max(batch_size, tensor.shape[0])
+
+    composite = torch.zeros((batch_size, canvas_height, canvas_width, 3), dtype=torch.float32)
+    for image, mask in zip(images, masks):
+        if image is None or mask is None:
+            continue
+        if isinstance(image, dict) and isinstance(mask, dict):
+            # sparse layers only touch their tile, outside it the layer is fully transparent
+            if image["tile"] is None or mask["tile"] is None:
+                continue
+            left, top = image["left"], image["top"]
+            tile = match_frames(image["tile"][..., :3], batch_size).to(composite)
+            height, width = tile.shape[1:3]
+            alpha = (1.0 - match_frames(mask["tile"], batch_size).to(composite)).unsqueeze(-1)
+            region = composite[:, top:top + height, left:left + width]
+            composite[:, top:top + height, left:left + width] = region * (1.0 - alpha) + tile * alpha
+            continue
+        # layers without transform data are not positioned on the canvas, nothing to blend
+        if isinstance(image, dict) or isinstance(mask, dict):
+            continue
+        if image.shape[1:3] != (canvas_height, canvas_width) or mask.shape[-2:] != (canvas_height, canvas_width):
+            continue
+        alpha = (1.0 - match_frames(mask.reshape((-1, canvas_height, canvas_width)), batch_size).to(composite)).unsqueeze(-1)
+        composite = composite * (1.0 - alpha) + match_frames(image[..., :3], batch_size).to(composite) * alpha
+    return composite
+
+
+def stack_variants(layers):
+    """
+    Concatenate one layer slot of several layout variants along the batch dimension
+    (variant after variant, sequences aligned to the longest one).
+    Sparse layers are stacked on the union of their tiles, layers without a layout
+    (plain tensors) are concatenated when they agree in size.
+
+    Parameters:
+    - layers: The slot's layer for each variant, sparse layers, tensors or None
+
+    Returns:
+    - A sparse layer, a tensor or None
+    """
+    present = [layer for layer in layers if layer is not None]
+    if not present:
+        return None
+
+    def frames(layer):
+        tensor = layer["tile"] if isinstance(layer, dict) else layer
+        return tensor.shape[0] if tensor is not None else 1
+    batch_size = max(frames(layer) for layer in present)
+
+    if all(isinstance(layer, dict) for layer in present):
+        tiles = [layer for layer in present if layer["tile"] is not None]
+        fill = present[0]["fill"]
+        if tiles:
+            left = min(layer["left"] for layer in tiles)
+            top = min(layer["top"] for layer in tiles)
+            right = max(layer["left"] + layer["tile"].shape[2] for layer in tiles)
+            bottom = max(layer["top"] + layer["tile"].shape[1] for layer in tiles)
+            channels = tuple(tiles[0]["tile"].shape[3:])
+        else:
+            left, top, right, bottom, channels = 0, 0, 1, 1, ()
+
+        stacked = torch.full((batch_size * len(present), bottom - top, right - left) + channels, float(fill), dtype=torch.float32)
+        for index, layer in enumerate(present):
+            tile = layer["tile"]
+            if tile is None:
+                continue
+            height, width = tile.shape[1:3]
+            y, x = layer["top"] - top, layer["left"] - left
+            stacked[index * batch_size:(index + 1) * batch_size, y:y + height, x:x + width] = match_frames(tile, batch_size)
+        return {"tile": stacked, "left": left, "top": top, "fill": fill}
+
+    if all(isinstance(layer, torch.Tensor) for layer in present) and len({tuple(layer.shape[1:]) for layer in present}) == 1:
+        return torch.cat([match_frames(layer, batch_size) for layer in present])
+
+    print("Layout variants disagree on a layer without transform data, keeping the first variant's")
+    return present[0]
+
+
+def position_layer(image_tensor, mask_tensor, canvas_width, canvas_height, left, top, padding, angle=0, scale_x=1.0, scale_y=1.0, placement="pil"):
+    """
+    Rotate, scale and place one compositor layer (and its mask) on the output canvas.
+
+    Parameters:
+    - image_tensor: Layer image tensor
+    - mask_tensor: Optional layer mask tensor
+    - canvas_width, canvas_height: Dimensions of the output canvas
+    - left, top: Top-left corner of the layer bbox in fabric canvas coordinates (padding included)
+    - padding: The fabric canvas padding around the output area
+    - angle: Clockwise rotation in degrees
+    - scale_x, scale_y: Scaling factors
+    - placement: "pil" or "torch"
+    left, top, angle, scale_x and scale_y can also be per-frame sequences (keyframed layers)
+
+    Returns:
+    - Tuple of (positioned image tensor, positioned mask tensor), one frame per input frame
+      (or per transform frame when there are more)
+    """
+    if placement != "torch" and image_tensor is not None:
+        masks = mask_tensor.reshape((-1, mask_tensor.shape[-2], mask_tensor.shape[-1])) if mask_tensor is not None else None
+        parameters = (left, top, angle, scale_x, scale_y)
+        keyframed = any(isinstance(value, (list, tuple)) for value in parameters)
+        frames = max([len(value) for value in parameters if isinstance(value, (list, tuple))], default=1)
+        batch_size = max(image_tensor.shape[0], masks.shape[0] if masks is not None else 1, frames)
+        if batch_size > 1 or keyframed:
+            # PIL works on single images, sequences go through it frame by frame with each frame's transform
+            # (torch placement does the whole batch in one resample)
+            images = match_frames(image_tensor, batch_size)
+            masks = match_frames(masks, batch_size) if masks is not None else None
+            placed = [
+                position_layer(images[i:i + 1], masks[i:i + 1] if masks is not None else None, canvas_width, canvas_height,
+                               *[frame_value(value, i) for value in (left, top)], padding,
+                               *[frame_value(value, i) for value in (angle, scale_x, scale_y)], placement)
+                for i in range(batch_size)
+            ]
+            return torch.cat([p[0] for p in placed]), torch.cat([p[1] for p in placed])
+
+    if placement == "torch":
+        # rotate, scale and translate in a single resample on the tensors
+        positioned_tensor, positioned_mask = place_on_canvas_torch(
+            image_tensor,
+            canvas_width,
+            canvas_height,
+            offset(left, -padding),  # Subtract padding from left position
+            offset(top, -padding),   # Subtract padding from top position
+            scale_x,
+            scale_y,
+            mask_tensor,
+            angle=angle
+        )
+        return positioned_tensor, positioned_mask
+    # First rotate if needed
+    elif angle != 0:
+        try:
+            # Scale and rotate in one step at the target resolution,
+            # so large sources are never rotated at full size
+            pil_image = tensor2pil(image_tensor)
+            rotated_pil = rotate_and_scale(pil_image, angle, scale_x, scale_y)
+            rotated_tensor = pil2tensor(rotated_pil)
+
+            # Handle mask rotation if mask exists
+            rotated_mask_tensor = None
+            if mask_tensor is not None:
+                pil_mask = tensor2pil(mask_tensor)
+                rotated_pil_mask = rotate_and_scale(pil_mask, angle, scale_x, scale_y)
+                rotated_mask_tensor = pil2tensor(rotated_pil_mask)
+
+            # Place the rotated image and mask on canvas using bbox position,
+            # scaling has already been applied
+            positioned_tensor, positioned_mask = place_on_canvas(
+                rotated_tensor, 
+                canvas_width, 
+                canvas_height,
+                left - padding,  # Subtract padding from left position
+                top - padding,   # Subtract padding from top position
+                1.0,
+                1.0,
+                rotated_mask_tensor
+            )
+            return positioned_tensor, positioned_mask
+        except Exception as e:
+            print(f"Error processing image: {e}")
+            # Fallback - place the original image using bbox position
+            positioned_tensor, positioned_mask = place_on_canvas(
+                image_tensor,
+                canvas_width,
+                canvas_height,
+                left,
+                top,
+                scale_x,
+                scale_y,
+                mask_tensor
+            )
+            return positioned_tensor, positioned_mask
+    else:
+        # No rotation needed, just position and scale using bbox position
+        # Subtract padding from left and top coordinates to correctly position in output
+        positioned_tensor, positioned_mask = place_on_canvas(
+            image_tensor,
+            canvas_width,
+            canvas_height,
+            left - padding,  # Subtract padding from left position
+            top - padding,   # Subtract padding from top position
+            scale_x,
+            scale_y,
+            mask_tensor
+        )
+        return positioned_tensor, positioned_mask
+
+
+def position_layers(layer_arguments, canvas_width, canvas_height, workers=1):
+    """
+    Position several layers (see position_layer) and crop them to their bbox (see crop_layer).
+    With more than one worker the layers are processed concurrently on a bounded pool.
+
+    Parameters:
+    - layer_arguments: List of position_layer argument tuples, one per layer
+    - canvas_width, canvas_height: Dimensions of the output canvas
+    - workers: Maximum number of layers processed at the same time
+
+    Returns:
+    - List of (sparse image, sparse mask) tuples in the order of layer_arguments
+    """
+    def run(arguments):
+        positioned_tensor, positioned_mask = position_layer(*arguments)
+        # only the layer bbox is kept, the rest of the canvas is implied
+        return crop_layer(positioned_tensor, positioned_mask, canvas_width, canvas_height)
+
+    if workers > 1 and len(layer_arguments) > 1:
+        # layers are independent and the heavy PIL/torch operations release the GIL
+        with ThreadPoolExecutor(max_workers=min(workers, len(layer_arguments))) as pool:
+            return list(pool.map(run, layer_arguments))
+    return [run(arguments) for arguments in layer_arguments]
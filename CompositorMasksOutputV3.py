@@ -1,6 +1,54 @@
 import torch
-from PIL import Image
-import numpy as np
+
+
+def match_frames(tensor, batch_size):
+    """
+    Brings a batched tensor to batch_size frames so layers of different lengths can be combined.
+    Single frames are broadcast without copying, shorter sequences hold their last frame
+    and longer ones are truncated.
+
+    Args:
+        tensor: Tensor whose first dimension is the batch
+        batch_size: Number of frames wanted
+
+    Returns:
+        Tensor with batch_size frames
+    """
+    frames = tensor.shape[0]
+    if frames == batch_size:
+        return tensor
+    if frames == 1:
+        return tensor.expand(batch_size, *tensor.shape[1:])
+    index = torch.arange(batch_size, device=tensor.device).clamp(max=frames - 1)
+    return tensor.index_select(0, index)
+
+
+def materialize_layer(layer, canvas_width, canvas_height, channels=None):
+    """
+    Expands a sparse layer produced by Compositor3 (tile + offset + fill value)
+    to a full-canvas tensor. Tensors and None are returned unchanged.
+
+    Args:
+        layer: None, a tensor or a dictionary with 'tile', 'left', 'top' and 'fill'
+        canvas_width, canvas_height: Dimensions of the canvas
+        channels: Number of channels for images, None for masks
+
+    Returns:
+        Full-canvas tensor [B, H, W, C] (images) or [B, H, W] (masks)
+    """
+    if not isinstance(layer, dict):
+        return layer
+
+    tile = layer["tile"]
+    batch_size = tile.shape[0] if tile is not None else 1
+    shape = (batch_size, canvas_height, canvas_width) + ((channels,) if channels else ())
+    full = torch.full(shape, float(layer["fill"]), dtype=torch.float32)
+    if tile is not None:
+        left, top = layer["left"], layer["top"]
+        height, width = tile.shape[1:3]
+        full[:, top:top + height, left:left + width] = tile
+    return full
+
 
 class CompositorMasksOutputV3:
     """
@@ -33,9 +81,11 @@ class CompositorMasksOutputV3:
         Unpacks the layer_outputs dictionary into individual image and mask outputs.
         
         Args:
-            layer_outputs: Dictionary containing 'images', 'masks', 'canvas_width', and 'canvas_height'
-            subtract_masks: When True, each mask will have higher-numbered masks subtracted from it
-                           (e.g., mask 6 = mask 6 - mask 7, mask 5 = mask 5 - mask 6, etc.)
+            layer_outputs: Dictionary containing 'images', 'masks', 'canvas_width', and 'canvas_height',
+                           images and masks can be sparse layers (see materialize_layer)
+            subtract_masks: When True, each mask will have the union of all higher-numbered masks subtracted
+                           from it, leaving only the region of the layer that is visible in the composite
+                           (e.g., mask 6 = mask 6 - (mask 7 + mask 8))
             
         Returns:
             Tuple of 16 tensors: 8 images and 8 masks in order
@@ -46,54 +96,52 @@ class CompositorMasksOutputV3:
         # Get canvas dimensions for creating empty images/masks if needed
         canvas_width = layer_outputs.get("canvas_width", 512)
         canvas_height = layer_outputs.get("canvas_height", 512)
-        
-        # Create a standard empty black image for missing values
+
+        # Create a standard empty black image for missing values, a broadcast view of a single
+        # pixel: unused slots cost no canvas allocation whether they are wired or not
         def create_empty_image(width, height):
-            empty_img = Image.new('RGB', (width, height), (0, 0, 0))
-            img_np = np.array(empty_img).astype(np.float32) / 255.0
-            return torch.from_numpy(img_np)[None, ]
+            return torch.zeros((1, 1, 1, 3), dtype=torch.float32).expand(1, height, width, 3)
         
-        # Create a standard empty mask (white) for missing values
+        # Create a standard empty mask (white) for missing values, broadcast like the images
         def create_empty_mask(width, height):
-            empty_mask = Image.new('L', (width, height), 255)  # White mask (completely transparent)
-            mask_np = np.array(empty_mask).astype(np.float32) / 255.0
-            return torch.from_numpy(mask_np)[None, ]
+            return torch.ones((1, 1, 1), dtype=torch.float32).expand(1, height, width)  # White mask (completely transparent)
         
         # Ensure we have 8 images and masks
         result_images = []
         result_masks = []
         
         for i in range(8):
-            # Handle images
+            # Handle images, layers travel as cropped tiles and are expanded to the canvas here
             if i < len(images) and images[i] is not None:
-                result_images.append(images[i])
+                result_images.append(materialize_layer(images[i], canvas_width, canvas_height, 3))
             else:
                 result_images.append(create_empty_image(canvas_width, canvas_height))
             
             # Handle masks
             if i < len(masks) and masks[i] is not None:
-                result_masks.append(masks[i])
+                result_masks.append(materialize_layer(masks[i], canvas_width, canvas_height))
             else:
                 result_masks.append(create_empty_mask(canvas_width, canvas_height))
         
         # Apply mask subtraction if enabled
         if subtract_masks:
-            processed_masks = result_masks.copy()
-            
-            # We start from the second-highest mask (index 6, mask 7) and work down
-            # mask 8 (index 7) remains unchanged
-            for i in range(6, -1, -1):
-                current_mask = processed_masks[i]
-                higher_mask = processed_masks[i+1]
-                
-                # Where higher mask has black pixels (visible content), make current mask white (transparent)
-                # In mask convention: black (0) = visible, white (1) = transparent
-                black_pixels_in_higher = higher_mask < 0.5
-                
-                # Apply the subtraction - where higher mask has black pixels, make current mask white
-                processed_masks[i] = torch.where(black_pixels_in_higher, torch.ones_like(current_mask), current_mask)
-            
-            result_masks = processed_masks
+            # [8, B, H, W], index 0 is the bottom layer, sequences of different lengths are aligned first
+            batch_size = max(mask.shape[0] for mask in result_masks)
+            stacked = torch.stack([match_frames(mask, batch_size) for mask in result_masks])
+
+            # In mask convention: black (0) = visible, white (1) = transparent
+            # slots without a layer don't occlude anything, whatever their empty mask is
+            present = torch.tensor([i < len(images) and images[i] is not None for i in range(8)])
+            visible = (stacked < 0.5).to(torch.float32) * present.reshape((-1,) + (1,) * (stacked.ndim - 1))
+
+            # Union of everything above each layer in one reverse cumulative pass:
+            # running max from the top layer down, shifted by one so a layer doesn't occlude itself
+            covered_from = torch.flip(torch.cummax(torch.flip(visible, [0]), dim=0).values, [0])
+            covered_above = torch.cat((covered_from[1:], torch.zeros_like(covered_from[:1])), dim=0)
+
+            # Where any higher layer is visible, make the current mask white (transparent)
+            # mask 8 (index 7) has nothing above and remains unchanged
+            result_masks = list(torch.where(covered_above > 0, torch.ones_like(stacked), stacked).unbind(0))
         
         # Return all images and masks as a flat tuple
         return (*result_images, *result_masks)
\ No newline at end of file
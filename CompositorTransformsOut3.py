@@ -8,6 +8,155 @@
 # from aiohttp import web
 
 import json
+from collections import namedtuple
+import numpy as np
+
+# one layer at one frame, in output coordinates (padding removed)
+LayerTransform = namedtuple("LayerTransform", ["x", "y", "width", "height", "angle", "bbox_x", "bbox_y", "bbox_width", "bbox_height"])
+
+# the fields of a fabricData layout layer_transforms reads, all transform_data keeps of the document
+LAYOUT_FIELDS = ("transforms", "bboxes", "keyframes", "padding", "frames")
+
+
+def keyframe_track(keyframes, frames=None):
+    """
+    Normalize a layer keyframe track to a list of (frame, transform, bbox) sorted by frame.
+
+    A track is either a list of {"frame": n, "transform": {...}, "bbox": {...}} keyframes
+    or {"start": {...}, "end": {...}, "frames": n} going from the first to the last frame,
+    transform and bbox hold any of the fields of the layer's fabricData records.
+    A start/end track without "frames" spans the given frames, the layer's batch size in the
+    compositor, there is no other default.
+    """
+    if isinstance(keyframes, dict):
+        count = keyframes.get("frames") or frames
+        if not count:
+            raise ValueError("start/end keyframe track needs a frame count: set its \"frames\", the layout's \"frames\" or the frames input")
+        return [
+            (0, keyframes.get("start", {}).get("transform", {}), keyframes.get("start", {}).get("bbox", {})),
+            (count - 1, keyframes.get("end", {}).get("transform", {}), keyframes.get("end", {}).get("bbox", {})),
+        ]
+    track = [(int(k.get("frame", 0)), k.get("transform", {}), k.get("bbox", {})) for k in keyframes]
+    return sorted(track, key=lambda k: k[0])
+
+
+def interpolate_keyframes(keyframes, transform, bbox, frames=None):
+    """
+    Per-frame transform and bbox records of a keyframed layer.
+    Each numeric field is interpolated linearly between the keyframes that set it and held
+    before the first and after the last of them, fields no keyframe sets keep the layer's value.
+
+    keyframes: the layer's keyframe track (see keyframe_track)
+    transform, bbox: the layer's static records from fabricData
+    frames: number of frames, defaults to the track's "frames" or last keyframe + 1
+
+    returns (transforms, bboxes), lists with one record per frame
+    """
+    track = keyframe_track(keyframes, frames)
+    if frames is None:
+        frames = track[-1][0] + 1
+    at = np.arange(frames)
+
+    def interpolate(static, record_index):
+        records = [dict(static) for _ in range(frames)]
+        fields = {field for key in track for field in key[record_index]}
+        for field in fields:
+            keyed = [(key[0], key[record_index][field]) for key in track
+                     if isinstance(key[record_index].get(field), (int, float)) and not isinstance(key[record_index].get(field), bool)]
+            if not keyed:
+                continue
+            values = np.interp(at, [k[0] for k in keyed], [k[1] for k in keyed])
+            for record, value in zip(records, values.tolist()):
+                record[field] = value
+        return records
+
+    return interpolate(transform, 1), interpolate(bbox, 2)
+
+
+def layer_transforms(layout, index, frames=None, default_frames=None):
+    """
+    Records of one layer of a parsed fabricData document, one per frame for keyframed layers.
+
+    frames: frame count overriding the document's
+    default_frames: frame count of a start/end track that doesn't give one (the layer's batch size)
+
+    returns a list of LayerTransform
+    """
+    padding = layout.get("padding", 0)
+    transforms = layout.get("transforms", [])
+    bboxes = layout.get("bboxes", [])
+    transform = transforms[index] if index < len(transforms) else {}
+    bbox = bboxes[index] if index < len(bboxes) else {}
+
+    keyframes = layout.get("keyframes") or []
+    if index < len(keyframes) and keyframes[index]:
+        track = keyframes[index]
+        frames = frames or layout.get("frames") or (default_frames if isinstance(track, dict) else None)
+        frame_transforms, frame_bboxes = interpolate_keyframes(track, transform, bbox, frames)
+    else:
+        frame_transforms, frame_bboxes = [transform], [bbox]
+
+    # remove the padding as transforms are padding based
+    return [
+        LayerTransform(
+            t.get("left", 0) - padding,
+            t.get("top", 0) - padding,
+            t.get("xwidth", 0) * t.get("scaleX", 1.0),
+            t.get("xheight", 0) * t.get("scaleY", 1.0),
+            t.get("angle", 0),
+            b.get("left", 0) - padding,
+            b.get("top", 0) - padding,
+            b.get("xwidth", 0),
+            b.get("xheight", 0),
+        )
+        for t, b in zip(frame_transforms, frame_bboxes)
+    ]
+
+
+def parse_transforms(data, frames=None, layer_frames=None):
+    """
+    Compact COMPOSITOR_TRANSFORMS structure of a fabricData document (or of a json array
+    of layouts, the variants following each other like in the compositor outputs).
+
+    data: fabricData, as a json string or already parsed
+    frames: frame count overriding the document's
+    layer_frames: batch size of each layer, used by start/end tracks without a frame count
+
+    returns {"layers": one list of LayerTransform per layer, "variants": number of layouts,
+             "layouts": the LAYOUT_FIELDS of each layout and "layer_frames", kept to re-time the layers
+             (see retime_transforms)}
+    """
+    if isinstance(data, str):
+        data = json.loads(data)
+    layouts = (data if isinstance(data, list) else [data]) or [{}]
+
+    layer_count = max(len(layout.get("transforms", [])) for layout in layouts)
+    layers = [[] for _ in range(layer_count)]
+    for layout in layouts:
+        for index in range(len(layout.get("transforms", []))):
+            default_frames = layer_frames[index] if layer_frames and index < len(layer_frames) else None
+            layers[index].extend(layer_transforms(layout, index, frames, default_frames))
+    return {
+        "layers": layers,
+        "variants": len(layouts),
+        "layouts": [{field: layout[field] for field in LAYOUT_FIELDS if field in layout} for layout in layouts],
+        "layer_frames": layer_frames,
+    }
+
+
+def retime_transforms(transform_data, frames):
+    """
+    transform_data parsed again with a frame count overriding the document's.
+    Structures without their layouts (the compositor's fallback output) are returned as they are.
+    """
+    layouts = transform_data.get("layouts")
+    if layouts is None:
+        return transform_data
+    return parse_transforms(layouts, frames, transform_data.get("layer_frames"))
+
+
+def transform_values(record, forceInt):
+    return tuple(int(value) for value in record) if forceInt else tuple(record)
 
 
 class CompositorTransformsOutV3:
@@ -16,11 +165,18 @@ class CompositorTransformsOutV3:
     def INPUT_TYPES(cls):
         return {
             "required": {
-                "transforms": ("STRING", {"forceInput": True}),
                 "channel": ("INT", {"min": 1, "max": 8, "default": 1}),
                 "forceInt": ("BOOLEAN", {"default": True}),
 
             },
+            "optional": {
+                "transforms": ("STRING", {"forceInput": True}),
+                # already parsed by the compositor, takes precedence over the json string
+                "transform_data": ("COMPOSITOR_TRANSFORMS",),
+                # frames of a keyframed layer, 0 uses the count from the keyframes (start/end tracks
+                # without one use the layer's batch size from transform_data, with transforms they need it)
+                "frames": ("INT", {"min": 0, "max": 4096, "default": 0}),
+            },
             "hidden": {
                 "extra_pnginfo": "EXTRA_PNGINFO",
                 "node_id": "UNIQUE_ID",
@@ -29,6 +185,8 @@ class CompositorTransformsOutV3:
 
     RETURN_TYPES = ("INT", "INT", "INT", "INT", "INT", "INT", "INT", "INT", "INT")
     RETURN_NAMES = ("x", "y", "width", "height", "angle", "bbox x", "bbox y", "bbox width", "bbox height")
+    # one value per frame for keyframed layers, a single value otherwise
+    OUTPUT_IS_LIST = (True, True, True, True, True, True, True, True, True)
 
     FUNCTION = "run"
     CATEGORY = "image"
@@ -36,30 +194,57 @@ class CompositorTransformsOutV3:
     def run(self, **kwargs):
         node_id = kwargs.pop('node_id', None)
         channel = kwargs.pop('channel', 1)
-        transforms = kwargs.pop('transforms', {})
+        transforms = kwargs.pop('transforms', None)
+        transform_data = kwargs.pop('transform_data', None)
         forceInt = kwargs.pop('forceInt', {})
+        frames = kwargs.pop('frames', 0)
         # print(transforms)
-        data = json.loads(transforms)
-        padding = data["padding"]
-        # extract transforms
-        t = data["transforms"]
-        width = t[channel - 1]["xwidth"] * t[channel - 1]["scaleX"]
-        height = t[channel - 1]["xheight"] * t[channel - 1]["scaleY"]
-        # remove the padding as transforms are padding based
-        x = t[channel - 1]["left"] - padding
-        y = t[channel - 1]["top"] - padding
-        #angle
-        angle = t[channel - 1]["angle"]
-
-        # bounding box out
-        b = data["bboxes"]
-        bwidth = b[channel - 1]["xwidth"]
-        bheight = b[channel - 1]["xheight"]
-        # remove the padding as transforms are padding based
-        bx = b[channel - 1]["left"] - padding
-        by = b[channel - 1]["top"] - padding
-
-        if forceInt:
-            return (int(x), int(y), int(width), int(height), int(angle), int(bx), int(by), int(bwidth), int(bheight))
-        else:
-            return (x, y, width, height, angle, bx, by, bwidth, bheight)
+        if transform_data is None and transforms is None:
+            raise ValueError("Compositor Transforms Output needs transforms or transform_data connected")
+        if transform_data is None:
+            transform_data = parse_transforms(transforms, frames or None)
+        elif frames:
+            # the frames override applies to the parsed structure as well
+            transform_data = retime_transforms(transform_data, frames)
+
+        layers = transform_data["layers"]
+        # no layer at this channel (e.g. the compositor's fallback for unparsable fabricData), nothing to output
+        records = layers[channel - 1] if channel <= len(layers) else []
+        if not records:
+            return tuple([] for _ in self.RETURN_TYPES)
+        # one list per output
+        return tuple(list(values) for values in zip(*[transform_values(record, forceInt) for record in records]))
+
+
+class CompositorTransformsOutAllV3:
+    """
+    Transforms of every layer in one execution, from the compositor's parsed transform_data.
+    Each output is a list ordered layer by layer (all frames of a layer, then the next layer),
+    channel and frame tell which layer and frame (batch index in the compositor outputs)
+    each entry belongs to.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "transform_data": ("COMPOSITOR_TRANSFORMS",),
+                "forceInt": ("BOOLEAN", {"default": True}),
+            },
+        }
+
+    RETURN_TYPES = ("INT", "INT", "INT", "INT", "INT", "INT", "INT", "INT", "INT", "INT", "INT")
+    RETURN_NAMES = ("channel", "frame", "x", "y", "width", "height", "angle", "bbox x", "bbox y", "bbox width", "bbox height")
+    OUTPUT_IS_LIST = (True, True, True, True, True, True, True, True, True, True, True)
+
+    FUNCTION = "run"
+    CATEGORY = "image"
+
+    def run(self, transform_data, forceInt=True):
+        rows = []
+        for channel, records in enumerate(transform_data["layers"], start=1):
+            for frame, record in enumerate(records):
+                rows.append((channel, frame) + transform_values(record, forceInt))
+        if not rows:
+            return tuple([] for _ in self.RETURN_TYPES)
+        return tuple(list(values) for values in zip(*rows))
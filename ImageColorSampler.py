@@ -2,10 +2,95 @@ import torch
 import numpy as np
 from PIL import Image
 import json
+import os
 import base64
+import hashlib
+import threading
+import time
 from io import BytesIO
+import comfy.model_management
+import folder_paths
 from server import PromptServer
+from aiohttp import web
 from comfy_execution.graph import ExecutionBlocker
+from .CompositorCache import PreviewStore, fingerprint_tensor, serve_preview
+from .ColorSampling import color_stripes, median_cut, window_means
+
+
+# (prompt id, node id) -> sampler paused for the user's sample points, see open_session
+sessions = {}
+sessions_lock = threading.Lock()
+# sessions nobody continues are dropped after SESSION_TIMEOUT seconds, and the oldest beyond MAX_SESSIONS
+SESSION_TIMEOUT = 3600
+MAX_SESSIONS = 64
+
+
+def expire_sessions():
+    """Drop stale sessions and the oldest ones beyond MAX_SESSIONS, the caller holds sessions_lock"""
+    now = time.monotonic()
+    for key, session in list(sessions.items()):
+        if not session["awaiting"] and now - session["created"] > SESSION_TIMEOUT:
+            del sessions[key]
+    paused = sorted((session["created"], key) for key, session in sessions.items() if not session["awaiting"])
+    for _, key in paused[:max(0, len(sessions) - MAX_SESSIONS)]:
+        del sessions[key]
+
+
+def open_session(prompt_id, node_id, client_id, awaiting):
+    """
+    Registers a sampler paused for the user's sample points.
+    Awaiting sessions are resumed in-process by /image_sampler/continue, the others are
+    picked up by the next run of the node from the same client (requeue).
+    """
+    session = {
+        "prompt_id": prompt_id,
+        "node_id": str(node_id),
+        "client_id": client_id,
+        "created": time.monotonic(),
+        "awaiting": awaiting,
+        "event": threading.Event(),
+        "sample_points": None,
+        "cancelled": False,
+    }
+    with sessions_lock:
+        expire_sessions()
+        sessions[(prompt_id, str(node_id))] = session
+    return session
+
+
+def take_paused_session(node_id, client_id):
+    """Removes and returns the requeue session this run of the node resumes, None for a first run"""
+    with sessions_lock:
+        expire_sessions()
+        for key, session in sessions.items():
+            if not session["awaiting"] and session["node_id"] == str(node_id) and session["client_id"] == client_id:
+                return sessions.pop(key)
+    return None
+
+
+def find_sessions(node_id=None, prompt_id=None):
+    """Sessions matching the node and/or prompt, newest first"""
+    with sessions_lock:
+        expire_sessions()
+        found = [session for session in sessions.values()
+                 if (node_id is None or session["node_id"] == str(node_id))
+                 and (prompt_id is None or session["prompt_id"] == prompt_id)]
+    return sorted(found, key=lambda session: session["created"], reverse=True)
+
+
+def session_info(session):
+    return {
+        "prompt_id": session["prompt_id"],
+        "node_id": session["node_id"],
+        "client_id": session["client_id"],
+        "age": time.monotonic() - session["created"],
+        "awaiting": session["awaiting"],
+    }
+
+
+# pixels considered by the auto palette, larger images are subsampled on a regular grid
+AUTO_PALETTE_PIXELS = 65536
+
 
 class ImageColorSampler:
     """
@@ -23,6 +108,18 @@ class ImageColorSampler:
                 "sample_size": ("INT", {"default": 1, "min": 1, "max": 30}),
                 "wait_for_input": ("BOOLEAN", {"default": True})
             },
+            "optional": {
+                # manual: colors from the clicked sample points, auto: dominant colors extracted without the ui
+                "mode": (["manual", "auto"], {"default": "manual"}),
+                "auto_colors": ("INT", {"default": 8, "min": 1, "max": 64}),
+                # longest side of the image shown for clicking, 0 sends the full resolution
+                "preview_size": ("INT", {"default": 1024, "min": 0, "max": 8192}),
+                # route: the ui fetches the preview over http, inline: base64 data url in the websocket message
+                "preview_transport": (["route", "inline"], {"default": "route"}),
+                # requeue: block and re-queue the prompt on continue, await: wait here for the continue
+                "continue_mode": (["requeue", "await"], {"default": "requeue"}),
+                "await_timeout": ("INT", {"default": 300, "min": 1, "max": 86400}),
+            },
             "hidden": {
                 "node_id": "UNIQUE_ID",
             },
@@ -39,21 +136,68 @@ class ImageColorSampler:
     # Enable list output for swatches, hex_codes, rgb_24bit, rgb_565, and rgb_values
     OUTPUT_IS_LIST = [False, False, True, True, True, True, True]
     
-    # Track which nodes are waiting for user input
-    waiting_nodes = set()
+    # encoded ui previews by image content and preview size, digest -> (bytes, mime type, (width, height))
+    # kept in the temp directory as well, so a preview url doesn't expire with its memory entry
+    preview_cache = PreviewStore("image_sampler_previews", os.path.join(folder_paths.get_temp_directory(), "image_sampler_previews"), max_bytes=128 * 1024 * 1024)
     
-    def tensor_to_base64_image(self, tensor):
-        """Convert a torch tensor to a base64 encoded image string"""
-        # Convert tensor to numpy and then to PIL image
-        img_np = tensor.cpu().numpy().squeeze(0)
-        img_np = (img_np * 255).astype(np.uint8)
-        img_pil = Image.fromarray(img_np)
-        
-        # Save to a bytes buffer and convert to base64
-        buffered = BytesIO()
-        img_pil.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        return f"data:image/png;base64,{img_str}"
+    def await_session(self, session, timeout):
+        """
+        Wait for /image_sampler/continue to deliver the sample points of an awaiting session.
+        Interrupting the prompt cancels the wait.
+
+        Returns the list of sample points, None on timeout or cancel
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            while not session["event"].wait(0.1):
+                comfy.model_management.throw_exception_if_processing_interrupted()
+                if time.monotonic() > deadline:
+                    print(f"Image sampler {session['node_id']}: no sample points received after {timeout}s, blocking")
+                    return None
+            if session["cancelled"]:
+                return None
+            points = session["sample_points"]
+            if isinstance(points, str):
+                try:
+                    points = json.loads(points)
+                except json.JSONDecodeError:
+                    points = []
+            return points or []
+        finally:
+            with sessions_lock:
+                sessions.pop((session["prompt_id"], session["node_id"]), None)
+
+    def preview_factor(self, image, preview_size):
+        """Downscale factor of the ui preview, 1.0 when the full resolution is shown"""
+        height, width = image.shape[1:3]
+        if not preview_size:
+            return 1.0
+        return min(1.0, preview_size / max(width, height))
+
+    def preview_image(self, image, preview_size, transport="route"):
+        """
+        Display-sized preview of the first frame for the ui, encoded once per image content.
+        Sample points are normalized, so they map back to the full resolution image.
+
+        Returns the preview route url, or a base64 data url for the inline transport
+        """
+        digest = hashlib.blake2b(repr((fingerprint_tensor(image), preview_size)).encode("utf-8"), digest_size=16).hexdigest()
+        encoded = self.preview_cache.get(digest)
+        if encoded is None:
+            img_np = np.clip(255. * image[0].cpu().numpy(), 0, 255).astype(np.uint8)
+            img_pil = Image.fromarray(img_np)
+            factor = self.preview_factor(image, preview_size)
+            if factor < 1.0:
+                size = (max(1, round(img_pil.width * factor)), max(1, round(img_pil.height * factor)))
+                img_pil = img_pil.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+            buffered = BytesIO()
+            # fast compression, the preview only needs to be quick to produce
+            img_pil.save(buffered, format="PNG", compress_level=1)
+            encoded = self.preview_cache.put(digest, (buffered.getvalue(), "image/png", img_pil.size))
+
+        if transport == "inline":
+            return f"data:{encoded[1]};base64,{base64.b64encode(encoded[0]).decode('utf-8')}"
+        return f"/image_sampler/preview/{digest}"
     
     def rgb_to_16bit(self, r, g, b, format='RGB565'):
         """
@@ -86,7 +230,8 @@ class ImageColorSampler:
         return (r << 16) | (g << 8) | b
         
     
-    def create_palette(self, image, sample_points, palette_size=128, sample_size=5, wait_for_input=True, node_id=None):
+    def create_palette(self, image, sample_points, palette_size=128, sample_size=5, wait_for_input=True, mode="manual", auto_colors=8,
+                       preview_size=1024, preview_transport="route", continue_mode="requeue", await_timeout=300, node_id=None):
         """
         Creates a color palette from the sampled points on the image.
         
@@ -96,48 +241,66 @@ class ImageColorSampler:
             palette_size: Size of the palette image (height in pixels)
             sample_size: Size of sample area (radius) for color averaging
             wait_for_input: Whether to block execution waiting for user input
+            mode: "manual" samples the clicked points, "auto" extracts a palette without waiting
+            auto_colors: Number of colors extracted in auto mode
+            preview_size: Longest side of the image shown in the ui, 0 for the full resolution
+            preview_transport: "route" to serve the preview over http, "inline" to send it as a data url
+            continue_mode: "requeue" blocks until the prompt is queued again, "await" pauses this execution
+            await_timeout: Seconds an awaiting sampler waits before blocking its outputs
             node_id: Unique ID of this node instance
         
         Returns:
             Tuple of (palette_image, sampled_colors_json, hex_codes_list, swatches_list, rgb_24bit_list, rgb_565_list, rgb_values_list)
         """
+        # Headless: nothing to click, the palette comes from the image itself
+        if mode == "auto":
+            return self.auto_palette(image, auto_colors, palette_size)
+
         # Parse the sample points
         try:
             points = json.loads(sample_points)
         except json.JSONDecodeError:
             points = []
         
+        # The prompt being executed and the client that queued it, messages only go to that client
+        prompt_id = getattr(PromptServer.instance, "last_prompt_id", None)
+        client_id = getattr(PromptServer.instance, "client_id", None)
+
         # Check if this is the initial call or a resumption after user input
-        is_initial_call = node_id not in self.waiting_nodes
+        is_initial_call = take_paused_session(node_id, client_id) is None
         
         # For initial call, send image data to the UI for interactive editing
         if (is_initial_call and wait_for_input):
-            # Convert image tensor to a base64 string for sending to UI
-            img_base64 = self.tensor_to_base64_image(image)
+            awaiting = continue_mode == "await"
+            # registered before notifying the UI, the continue may come back quickly
+            session = open_session(prompt_id, node_id, client_id, awaiting)
+
+            # Display-sized preview for the UI, cached by image content
+            img_preview = self.preview_image(image, preview_size, preview_transport)
             
             # Send image and current points to the UI
             ui_data = {
-                "image": img_base64,
+                "image": img_preview,
                 "sample_points": points,
                 "sample_size": sample_size,
-                "node_id": node_id
+                "node_id": node_id,
+                "image_width": image.shape[2],
+                "image_height": image.shape[1],
+                "prompt_id": prompt_id,
             }
             
             # Send message to UI to display the image for interaction
-            PromptServer.instance.send_sync("image_sampler_init", {"node": node_id, "data": ui_data})
-            
-            # Add to waiting nodes and block execution
-            self.waiting_nodes.add(node_id)
-            
-            # Return ExecutionBlocker for all outputs
-            return (ExecutionBlocker(None), ExecutionBlocker(None), ExecutionBlocker(None), ExecutionBlocker(None), ExecutionBlocker(None), ExecutionBlocker(None), ExecutionBlocker(None))
-        
-        # Remove from waiting list if resuming
-        if node_id in self.waiting_nodes:
-            self.waiting_nodes.remove(node_id)
+            PromptServer.instance.send_sync("image_sampler_init", {"node": node_id, "data": ui_data}, client_id)
+
+            # In-process: resume with the points sent by the continue
+            resumed = self.await_session(session, await_timeout) if awaiting else None
+            if resumed is None:
+                # Return ExecutionBlocker for all outputs
+                return (ExecutionBlocker(None), ExecutionBlocker(None), ExecutionBlocker(None), ExecutionBlocker(None), ExecutionBlocker(None), ExecutionBlocker(None), ExecutionBlocker(None))
+            points = resumed
         
-        # Convert image tensor to numpy array
-        img_np = image.cpu().numpy().squeeze(0)
+        # Convert image tensor to numpy array, colors are sampled on the first frame
+        img_np = image[0].cpu().numpy()
         
         # Image dimensions
         height, width, _ = img_np.shape
@@ -150,59 +313,96 @@ class ImageColorSampler:
             empty_swatch = torch.from_numpy(np.zeros((palette_size, palette_size, 3), dtype=np.float32))[None, ]
             return (palette_tensor, "[]", [], [empty_swatch], [], [], [])
             
-        # Calculate colors for each sample point
-        sampled_colors = []
+        # Use exact color from JavaScript when sample_size is 1, otherwise do averaging
+        picked = [sample_size == 1 and "color" in point and isinstance(point["color"], str) and point["color"].startswith("#")
+                  for point in points]
+        # colors picked on a downscaled preview aren't exact, the full resolution pixel is read instead
+        downscaled = self.preview_factor(image, preview_size) < 1.0
+        exact = [is_picked and not downscaled for is_picked in picked]
+
+        # 8-bit RGB of every point, the averaged ones computed together (one pass per radius)
+        rgb = np.zeros((len(points), 3), dtype=np.int64)
+        averaged = [index for index, is_exact in enumerate(exact) if not is_exact]
+        for radius, group in ((0, [index for index in averaged if picked[index]]),
+                              (sample_size, [index for index in averaged if not picked[index]])):
+            if not group:
+                continue
+            # Ensure coordinates are within bounds
+            xs = np.array([int(points[index]["x"] * width) for index in group])
+            ys = np.array([int(points[index]["y"] * height) for index in group])
+            xs = np.maximum(radius, np.minimum(width - radius - 1, xs))
+            ys = np.maximum(radius, np.minimum(height - radius - 1, ys))
+
+            # Sample area - take average color in the sample radius, truncated to 8 bits
+            avg_colors = window_means(img_np, xs, ys, radius)
+            rgb[group] = (avg_colors * np.float32(255)).astype(np.int64)
+
+        # Resolve the color and hex code of each sample point
         hex_codes = []
-        swatches = []
-        rgb_24bit = []
-        rgb_565 = []
-        rgb_values = []
-        
-        for point in points:
-            x = int(point["x"] * width)
-            y = int(point["y"] * height)
-            
-            # Use exact color from JavaScript when sample_size is 1, otherwise do averaging
-            if sample_size == 1 and "color" in point and isinstance(point["color"], str) and point["color"].startswith("#"):
+        for index, point in enumerate(points):
+            if exact[index]:
                 # Use the hex color directly from JavaScript for exact values
                 hex_color = point["color"]
                 
                 # Parse hex color to RGB
-                r = int(hex_color[1:3], 16)
-                g = int(hex_color[3:5], 16)
-                b = int(hex_color[5:7], 16)
+                rgb[index] = (int(hex_color[1:3], 16), int(hex_color[3:5], 16), int(hex_color[5:7], 16))
             else:
-                # Use averaging for larger sample sizes or when color isn't specified
-                # Ensure coordinates are within bounds
-                x = max(sample_size, min(width - sample_size - 1, x))
-                y = max(sample_size, min(height - sample_size - 1, y))
-                
-                # Sample area - take average color in the sample radius
-                sample_area = img_np[y-sample_size:y+sample_size+1, x-sample_size:x+sample_size+1]
-                avg_color = np.mean(sample_area, axis=(0, 1))
-                
-                # Convert to 8-bit RGB
-                r, g, b = [int(c * 255) for c in avg_color]
-                
                 # Create hex code
+                r, g, b = (int(c) for c in rgb[index])
                 hex_color = f"#{r:02X}{g:02X}{b:02X}"
-            
             hex_codes.append(hex_color)
+
+        positions = [{"x": point["x"], "y": point["y"]} for point in points]
+        return self.palette_outputs(rgb, hex_codes, positions, palette_size)
+
+    def auto_palette(self, image, num_colors, palette_size):
+        """
+        Extracts the dominant colors of the image with median cut, no sample points involved.
+        Colors are ordered by the share of the image they stand for.
+        """
+        # colors are extracted from the first frame, on a regular subsample of large images
+        img_np = image[0].cpu().numpy()
+        height, width, _ = img_np.shape
+        step = max(1, int(np.ceil(np.sqrt(height * width / AUTO_PALETTE_PIXELS))))
+        pixels = np.ascontiguousarray(img_np[::step, ::step, :3]).reshape(-1, 3)
+
+        colors, counts = median_cut(pixels, num_colors)
+        rgb = (colors * np.float32(255)).astype(np.int64)
+        hex_codes = [f"#{r:02X}{g:02X}{b:02X}" for r, g, b in rgb.tolist()]
+        shares = (counts / counts.sum()).tolist()
+        return self.palette_outputs(rgb, hex_codes, [None] * len(rgb), palette_size, shares)
+
+    def palette_outputs(self, rgb, hex_codes, positions, palette_size, shares=None):
+        """
+        Builds the node outputs from the palette colors.
+
+        Args:
+            rgb: Integer array [N, 3] of 8-bit colors
+            hex_codes: Hex code of each color
+            positions: Normalized sample position of each color, None for extracted colors
+            palette_size: Size of the palette and swatch images
+            shares: Optional fraction of the image each color stands for (auto palette)
+
+        Returns:
+            The node's output tuple
+        """
+        sampled_colors = []
+        rgb_24bit = []
+        rgb_565 = []
+        rgb_values = []
+        
+        for index, hex_color in enumerate(hex_codes):
+            r, g, b = (int(c) for c in rgb[index])
             
             # Add to colors list with position info
-            sampled_colors.append({
-                "position": {"x": point["x"], "y": point["y"]},
+            sampled_color = {
+                "position": positions[index],
                 "color": {"r": r, "g": g, "b": b},
                 "hex": hex_color
-            })
-            
-            # Create a swatch image for this color
-            swatch_img = np.zeros((palette_size, palette_size, 3), dtype=np.float32)
-            swatch_img[:, :, 0] = r / 255.0
-            swatch_img[:, :, 1] = g / 255.0
-            swatch_img[:, :, 2] = b / 255.0
-            swatch_tensor = torch.from_numpy(swatch_img)[None, ]
-            swatches.append(swatch_tensor)
+            }
+            if shares is not None:
+                sampled_color["share"] = shares[index]
+            sampled_colors.append(sampled_color)
             
             # Add 24-bit RGB value to list using the dedicated method
             rgb_24bit.append(self.rgb_to_24bit(r, g, b))
@@ -212,31 +412,14 @@ class ImageColorSampler:
             
             # Add RGB values to list
             rgb_values.append(f"({r}, {g}, {b})")
-            
-        # Create palette image
-        num_colors = len(sampled_colors)
-        if num_colors == 0:
-            # Create empty palette
-            palette_img = np.zeros((palette_size, palette_size, 3), dtype=np.float32)
-            palette_tensor = torch.from_numpy(palette_img)[None, ]
-            empty_swatch = torch.from_numpy(np.zeros((palette_size, palette_size, 3), dtype=np.float32))[None, ]
-            return (palette_tensor, "[]", [], [empty_swatch], [], [], [])
+
+        # One swatch image per color, filled in a single broadcast and split into the list output
+        colors = (rgb / 255.0).astype(np.float32)
+        swatch_batch = torch.from_numpy(colors)[:, None, None, :].repeat(1, palette_size, palette_size, 1)
+        swatches = list(swatch_batch.split(1))
             
         # Create palette image - a horizontal strip of colors
-        stripe_height = palette_size
-        stripe_width = palette_size // num_colors if num_colors > 0 else palette_size
-        
-        palette_img = np.zeros((stripe_height, palette_size, 3), dtype=np.float32)
-        
-        for i, color_data in enumerate(sampled_colors):
-            color = color_data["color"]
-            start_x = i * stripe_width
-            end_x = (i + 1) * stripe_width if i < num_colors - 1 else palette_size
-            
-            # Fill the stripe with the color
-            palette_img[:, start_x:end_x, 0] = color["r"] / 255.0
-            palette_img[:, start_x:end_x, 1] = color["g"] / 255.0
-            palette_img[:, start_x:end_x, 2] = color["b"] / 255.0
+        palette_img = color_stripes(colors, palette_size)
         
         # Convert to tensor
         palette_tensor = torch.from_numpy(palette_img)[None, ]
@@ -273,13 +456,52 @@ async def image_sampler_continue(request):
     """Handle when user is done selecting color samples and wants to continue"""
     data = await request.json()
     node_id = data.get("node_id")
+    prompt_id = data.get("prompt_id")
     sample_points = data.get("sample_points", "[]")
-    
-    # Update the sample_points widget value to continue with new points
+
+    # the session of this prompt, or the node's latest one for clients that don't send the prompt id
+    found = find_sessions(node_id, prompt_id) if prompt_id else find_sessions(node_id)
+    session = found[0] if found else None
+    # without a session (e.g. after a server restart) the requesting client re-queues
+    client_id = session["client_id"] if session is not None else data.get("client_id")
+
+    resumed = session is not None and session["awaiting"]
+    if resumed:
+        # the paused execution picks the points up directly
+        session["sample_points"] = sample_points
+        session["event"].set()
+
+    # Update the sample_points widget value, re-queueing only when nothing is waiting in-process
     PromptServer.instance.send_sync("image_sampler_update", {
         "node": node_id,
         "widget_name": "sample_points",
-        "value": json.dumps(sample_points)
-    })
+        "value": json.dumps(sample_points),
+        "requeue": not resumed,
+    }, client_id)
     
-    return {"status": "success"}
\ No newline at end of file
+    return web.json_response({"status": "resumed" if resumed else "requeued"})
+
+
+@PromptServer.instance.routes.get("/image_sampler/sessions")
+async def image_sampler_sessions(request):
+    return web.json_response([session_info(session) for session in find_sessions()])
+
+
+# cancel the sessions of a node and/or prompt, e.g. {"node_id": "12"} or {"prompt_id": "...", "node_id": "12"}
+@PromptServer.instance.routes.post("/image_sampler/cancel")
+async def image_sampler_cancel(request):
+    data = await request.json()
+    cancelled = find_sessions(data.get("node_id"), data.get("prompt_id"))
+    with sessions_lock:
+        for session in cancelled:
+            sessions.pop((session["prompt_id"], session["node_id"]), None)
+            # an awaiting execution stops waiting and blocks its outputs
+            session["cancelled"] = True
+            session["event"].set()
+    return web.json_response({"cancelled": [session_info(session) for session in cancelled]})
+
+
+# previews are content addressed, so the browser can cache them for good and revalidate with the etag
+@PromptServer.instance.routes.get("/image_sampler/preview/{digest}")
+async def image_sampler_preview(request):
+    return await serve_preview(request, ImageColorSampler.preview_cache)
@@ -1,31 +1,41 @@
 # author: erosdiffusionai@gmail.com
-from .Compositor3 import Compositor3
-from .CompositorConfig3 import CompositorConfig3
-from .CompositorTools3 import CompositorTools3
-from .CompositorTransformsOut3 import CompositorTransformsOutV3
-from .CompositorMasksOutputV3 import CompositorMasksOutputV3
-from .CompositorColorPicker import CompositorColorPicker
-from .ImageColorSampler import ImageColorSampler
+import importlib.util
 
-NODE_CLASS_MAPPINGS = {
-    "Compositor3": Compositor3,
-    "CompositorConfig3": CompositorConfig3,
-    "CompositorTools3": CompositorTools3,
-    "CompositorTransformsOutV3": CompositorTransformsOutV3,
-    "CompositorMasksOutputV3": CompositorMasksOutputV3,
-    "CompositorColorPicker": CompositorColorPicker,
-    "ImageColorSampler": ImageColorSampler,
-}
+# the nodes need a running ComfyUI, imported on its own (e.g. by pytest collecting the tests)
+# the package registers nothing
+if importlib.util.find_spec("folder_paths") is not None:
+    from .Compositor3 import Compositor3
+    from .CompositorConfig3 import CompositorConfig3
+    from .CompositorTools3 import CompositorTools3
+    from .CompositorTransformsOut3 import CompositorTransformsOutV3, CompositorTransformsOutAllV3
+    from .CompositorMasksOutputV3 import CompositorMasksOutputV3
+    from .CompositorColorPicker import CompositorColorPicker
+    from .ImageColorSampler import ImageColorSampler
 
-NODE_DISPLAY_NAME_MAPPINGS = {
-    "Compositor3": "💜 Compositor (V3)",
-    "CompositorConfig3": "💜 Compositor Config (V3)",
-    "CompositorTools3": "💜 Compositor Tools (V3) Experimental",
-    "CompositorTransformsOutV3": "💜 Compositor Transforms Output (V3)",
-    "CompositorMasksOutputV3": "💜 Compositor Masks Output (V3)",
-    "CompositorColorPicker": "💜 Compositor Color Picker",
-    "ImageColorSampler": "💜 Image Color Sampler",
-}
+    NODE_CLASS_MAPPINGS = {
+        "Compositor3": Compositor3,
+        "CompositorConfig3": CompositorConfig3,
+        "CompositorTools3": CompositorTools3,
+        "CompositorTransformsOutV3": CompositorTransformsOutV3,
+        "CompositorTransformsOutAllV3": CompositorTransformsOutAllV3,
+        "CompositorMasksOutputV3": CompositorMasksOutputV3,
+        "CompositorColorPicker": CompositorColorPicker,
+        "ImageColorSampler": ImageColorSampler,
+    }
+
+    NODE_DISPLAY_NAME_MAPPINGS = {
+        "Compositor3": "💜 Compositor (V3)",
+        "CompositorConfig3": "💜 Compositor Config (V3)",
+        "CompositorTools3": "💜 Compositor Tools (V3) Experimental",
+        "CompositorTransformsOutV3": "💜 Compositor Transforms Output (V3)",
+        "CompositorTransformsOutAllV3": "💜 Compositor Transforms Output All Channels (V3)",
+        "CompositorMasksOutputV3": "💜 Compositor Masks Output (V3)",
+        "CompositorColorPicker": "💜 Compositor Color Picker",
+        "ImageColorSampler": "💜 Image Color Sampler",
+    }
+else:
+    NODE_CLASS_MAPPINGS = {}
+    NODE_DISPLAY_NAME_MAPPINGS = {}
 
 EXTENSION_NAME = "Enrico"
 
@@ -0,0 +1,40 @@
+"""
+The nodes are a ComfyUI custom node package: modules use relative imports and the package
+__init__ registers the nodes with a running ComfyUI. The modules without ComfyUI imports are
+loaded here under an alias package, so they can be tested on their own.
+
+Timing benchmarks are marked with @pytest.mark.benchmark and only run with COMPOSITOR_BENCHMARKS=1.
+"""
+import importlib
+import os
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+PACKAGE = "compositor_nodes"
+
+
+def load_module(name):
+    """import a module of the repository by name, e.g. load_module("CompositorCache")"""
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [str(ROOT)]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.{name}")
+
+
+@pytest.fixture(scope="session")
+def repo_module():
+    return load_module
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.environ.get("COMPOSITOR_BENCHMARKS") == "1":
+        return
+    skip = pytest.mark.skip(reason="benchmark, set COMPOSITOR_BENCHMARKS=1 to run it")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
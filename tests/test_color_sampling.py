@@ -0,0 +1,78 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.fixture(scope="module")
+def color_sampling(repo_module):
+    return repo_module("ColorSampling")
+
+
+def loop_means(img_np, xs, ys, radius):
+    """the per-point sampling ImageColorSampler.create_palette used before window_means"""
+    return np.array([np.mean(img_np[y - radius:y + radius + 1, x - radius:x + radius + 1], axis=(0, 1))
+                     for x, y in zip(xs, ys)])
+
+
+def sample_points(rng, width, height, radius, count):
+    xs = rng.integers(0, width, count)
+    ys = rng.integers(0, height, count)
+    # clamped like create_palette does
+    return np.clip(xs, radius, width - radius - 1), np.clip(ys, radius, height - radius - 1)
+
+
+# few points go through the gather, many points with a large radius through the summed-area table
+@pytest.mark.parametrize("radius,count", [(1, 10), (5, 40), (1, 5000), (15, 400), (30, 200)])
+def test_window_means_parity(color_sampling, radius, count):
+    rng = np.random.default_rng(radius * 1000 + count)
+    img_np = rng.random((120, 160, 3), dtype=np.float32)
+    xs, ys = sample_points(rng, 160, 120, radius, count)
+
+    expected = loop_means(img_np, xs, ys, radius)
+    reference = loop_means(img_np.astype(np.float64), xs, ys, radius)
+    means = color_sampling.window_means(img_np, xs, ys, radius)
+
+    assert means.dtype == np.float32 and means.shape == expected.shape
+    # the table sums in float64, only the cast back to float32 is left against an exact mean
+    # (the old float32 accumulation drifts with the window size, 1e-6 over 61x61 windows)
+    np.testing.assert_allclose(means, reference, rtol=0, atol=1e-7)
+
+    # 8-bit colors, truncated like create_palette: identical except where a value sits on an
+    # integer boundary within float32 rounding, and there they are one step apart at most
+    new_rgb = (means * np.float32(255)).astype(np.int64)
+    old_rgb = (expected * np.float32(255)).astype(np.int64)
+    scaled = reference * 255
+    exact = np.abs(scaled - np.round(scaled)) > 1e-3
+    assert np.array_equal(new_rgb[exact], old_rgb[exact])
+    assert np.abs(new_rgb - old_rgb).max() <= 1
+
+
+def test_window_means_constant_image(color_sampling):
+    img_np = np.full((64, 64, 3), 0.25, dtype=np.float32)
+    xs, ys = np.array([10, 30, 50]), np.array([10, 30, 50])
+    for radius in (0, 3, 9):
+        assert np.array_equal(color_sampling.window_means(img_np, xs, ys, radius), np.full((3, 3), 0.25, dtype=np.float32))
+
+
+def test_window_means_radius_zero_reads_the_pixel(color_sampling):
+    rng = np.random.default_rng(0)
+    img_np = rng.random((32, 48, 3), dtype=np.float32)
+    xs, ys = rng.integers(0, 48, 20), rng.integers(0, 32, 20)
+    assert np.array_equal(color_sampling.window_means(img_np, xs, ys, 0), img_np[ys, xs])
+
+
+def test_median_cut_separates_clusters(color_sampling):
+    pixels = np.concatenate([np.full((200, 3), 0.1), np.full((200, 3), 0.9)]).astype(np.float32)
+    colors, counts = color_sampling.median_cut(pixels, 4)
+    # no box with more than one color is left after the first split
+    assert len(colors) == 2
+    np.testing.assert_allclose(colors, [[0.1] * 3, [0.9] * 3], atol=1e-6)
+    assert counts.tolist() == [200, 200]
+
+
+def test_color_stripes(color_sampling):
+    colors = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float32)
+    palette = color_sampling.color_stripes(colors, 8)
+    assert palette.shape == (8, 8, 3)
+    # stripes of 2 columns, the last color takes the remainder
+    assert [int(np.argmax(palette[0, column])) for column in range(8)] == [0, 0, 1, 1, 2, 2, 2, 2]
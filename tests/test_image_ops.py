@@ -0,0 +1,166 @@
+import time
+from io import BytesIO
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+F = pytest.importorskip("torch.nn.functional")
+Image = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture(scope="module")
+def image_ops(repo_module):
+    return repo_module("CompositorImageOps")
+
+
+def scale_image(image_tensor, new_height):
+    """the per-layer normalizeHeight resize CompositorConfig3 used before normalize_height"""
+    aspect_ratio = image_tensor.shape[2] / image_tensor.shape[1]
+    new_width = int(new_height * aspect_ratio)
+    resized = F.interpolate(image_tensor.permute(0, 3, 1, 2), size=(new_height, new_width), mode="bilinear", align_corners=False)
+    return resized.permute(0, 2, 3, 1)
+
+
+def smooth_layer(height, width, frames=1):
+    y = torch.linspace(0, 1, height).reshape(1, height, 1, 1)
+    x = torch.linspace(0, 1, width).reshape(1, 1, width, 1)
+    phase = torch.arange(frames, dtype=torch.float32).reshape(frames, 1, 1, 1)
+    return torch.cat((x.expand(frames, height, width, 1), y.expand(frames, height, width, 1),
+                      (0.5 + 0.5 * torch.sin(x * 8 + y * 5 + phase)).expand(frames, height, width, 1)), dim=-1)
+
+
+def layers_and_masks():
+    images = [smooth_layer(300, 400), smooth_layer(300, 400, 2), smooth_layer(1000, 700), smooth_layer(512, 512), smooth_layer(120, 90)]
+    masks = [image[..., 0] for image in images[:3]] + [None, images[4][..., 2]]
+    return images, masks
+
+
+def test_normalize_height_sizes(image_ops):
+    images, masks = layers_and_masks()
+    resized_images, resized_masks = image_ops.normalize_height(images, masks, 512)
+    for image, mask, resized_image, resized_mask in zip(images, masks, resized_images, resized_masks):
+        assert resized_image.shape == scale_image(image, 512).shape
+        if mask is None:
+            assert resized_mask is None
+        else:
+            # the mask follows its image, apply_mask has nothing left to stretch
+            assert resized_mask.shape == resized_image.shape[:3]
+
+
+def test_normalize_height_parity(image_ops):
+    images, masks = layers_and_masks()
+    resized_images, resized_masks = image_ops.normalize_height(images, masks, 512)
+    for image, mask, resized_image, resized_mask in zip(images, masks, resized_images, resized_masks):
+        expected = scale_image(image, 512)
+        assert torch.allclose(resized_image, expected, atol=1e-6)
+        if mask is not None:
+            # previously the mask was stretched to the resized image by apply_mask
+            assert torch.allclose(resized_mask, image_ops.resize_mask(mask, expected.shape[1:]), atol=1e-6)
+
+
+def test_normalize_height_antialias(image_ops):
+    images, masks = layers_and_masks()
+    resized_images, resized_masks = image_ops.normalize_height(images, masks, 512, antialias=True)
+    for image, mask, resized_image, resized_mask in zip(images, masks, resized_images, resized_masks):
+        expected = scale_image(image, 512)
+        assert resized_image.shape == expected.shape
+        # only downscaling is filtered, and only differs from the plain bilinear one by its filtering
+        tolerance = 0.01 if image.shape[1] > 512 else 1e-6
+        assert (resized_image - expected).abs().mean() < tolerance
+        if mask is not None:
+            assert (resized_mask - image_ops.resize_mask(mask, expected.shape[1:])).abs().mean() < tolerance
+
+
+def test_resize_layers_matches_single_resizes(image_ops):
+    tensors = [torch.rand(1, 64, 48, 3), torch.rand(2, 64, 48, 3), torch.rand(1, 64, 48, 1), torch.rand(1, 32, 32, 3)]
+    sizes = [(32, 24), (32, 24), (32, 24), (32, 32)]
+    resized = image_ops.resize_layers(tensors, sizes)
+    # already at its size, returned as is
+    assert resized[3] is tensors[3]
+    for tensor, size, result in zip(tensors[:3], sizes, resized):
+        expected = F.interpolate(tensor.permute(0, 3, 1, 2).contiguous(), size=size, mode="bilinear", align_corners=False)
+        assert torch.allclose(result, expected.permute(0, 2, 3, 1), atol=1e-6)
+
+
+def test_resize_mask_skips_matching_masks(image_ops):
+    mask = torch.rand(2, 16, 16)
+    assert image_ops.resize_mask(mask, (16, 16, 3)).data_ptr() == mask.data_ptr()
+
+
+@pytest.mark.benchmark
+def test_normalize_height_timing(image_ops):
+    # 8 large layers and their masks to the default 512 height, a typical normalizeHeight config
+    images = [smooth_layer(1536, 2048) for _ in range(8)]
+    masks = [image[..., 0].clone() for image in images]
+
+    def before():
+        for image, mask in zip(images, masks):
+            resized = scale_image(image, 512)
+            image_ops.resize_mask(mask, resized.shape[1:])
+
+    def after():
+        image_ops.normalize_height(images, masks, 512)
+
+    timings = {}
+    for name, run in (("per layer", before), ("normalize_height", after)):
+        run()
+        start = time.perf_counter()
+        for _ in range(3):
+            run()
+        timings[name] = (time.perf_counter() - start) / 3
+    print(f"\nnormalizeHeight, 8 layers 2048x1536 + masks: {', '.join(f'{name} {seconds * 1000:.1f} ms' for name, seconds in timings.items())}")
+    # resizing on the channels-last views copies nothing, it must not cost more than the per layer resize
+    assert timings["normalize_height"] < timings["per layer"] * 2
+
+
+def test_encode_preview_modes(image_ops):
+    image = smooth_layer(600, 800)
+    mask = image[..., 1].clone()
+
+    data, content_type, size = image_ops.encode_preview(image, mask, False)
+    assert content_type == "image/png" and size == (800, 600)
+    full = Image.open(BytesIO(data))
+    assert full.mode == "RGBA" and full.size == size
+
+    proxies = {}
+    for preview, expected_type in (("proxy png", "image/png"), ("proxy webp", "image/webp")):
+        data, content_type, size = image_ops.encode_preview(image, mask, False, preview, (400, 400))
+        assert content_type == expected_type
+        # fits the display size, keeping the aspect ratio
+        assert size == (400, 300)
+        proxies[preview] = np.asarray(Image.open(BytesIO(data)).convert("RGBA"))
+    # both proxy encoders are lossless, they carry the same pixels (webp may drop the color of
+    # fully transparent ones)
+    png, webp = proxies["proxy png"], proxies["proxy webp"]
+    visible = png[..., 3] > 0
+    assert np.array_equal(png[..., 3], webp[..., 3])
+    assert np.array_equal(png[visible], webp[visible])
+
+    # a layer smaller than the display is not upscaled
+    assert image_ops.encode_preview(image, None, False, "proxy png", (2000, 2000))[2] == (800, 600)
+
+
+@pytest.mark.benchmark
+def test_encode_preview_timing(image_ops):
+    # a 2048x1536 layer with its mask shown on a 1024x768 compositor canvas
+    rng = np.random.default_rng(0)
+    image = (smooth_layer(1536, 2048) + torch.from_numpy(rng.normal(0, 0.02, (1, 1536, 2048, 3)).astype(np.float32))).clamp(0, 1)
+    mask = image[..., 0].clone()
+
+    lines = []
+    results = {}
+    for preview in ("png", "proxy png", "proxy webp"):
+        proxy_size = (1024, 768) if preview != "png" else None
+        image_ops.encode_preview(image, mask, False, preview, proxy_size)
+        start = time.perf_counter()
+        for _ in range(3):
+            data, _, size = image_ops.encode_preview(image, mask, False, preview, proxy_size)
+        results[preview] = ((time.perf_counter() - start) / 3, len(data))
+        lines.append(f"{preview:>10}: {size[0]}x{size[1]} {results[preview][0] * 1000:7.1f} ms {len(data) / 1024:8.1f} KiB")
+    print("\nencode_preview, 2048x1536 layer + mask:\n" + "\n".join(lines))
+
+    # png at full resolution is the encoding used before the proxies
+    for preview in ("proxy png", "proxy webp"):
+        assert results[preview][0] < results["png"][0]
+        assert results[preview][1] < results["png"][1]
@@ -0,0 +1,133 @@
+import os
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+Image = pytest.importorskip("PIL.Image")
+
+ANGLES = [0, 15, 33.3, 45, 90, 120, 180, 200.5, 270, -30, 359.9]
+SCALES = [(0.15, 0.15), (0.5, 0.5), (0.8, 0.6), (1.0, 1.0), (1.7, 1.2)]
+
+
+@pytest.fixture(scope="module")
+def layers(repo_module):
+    return repo_module("CompositorLayers")
+
+
+def smooth_image(width=600, height=400):
+    """gradients and a low frequency pattern, resampling order only changes it by rounding"""
+    x = np.linspace(0, 1, width)[None, :]
+    y = np.linspace(0, 1, height)[:, None]
+    rgb = np.stack(np.broadcast_arrays(x, y, 0.5 + 0.5 * np.sin(x * 9) * np.cos(y * 7)), axis=-1)
+    return Image.fromarray((rgb * 255).astype(np.uint8))
+
+
+def rotate_then_scale(pil_image, angle, scale_x, scale_y):
+    """the placement path before rotate_and_scale: rotate at full size, then resize the expanded bbox"""
+    if angle != 0:
+        pil_image = pil_image.rotate(-angle, expand=True, resample=Image.Resampling.BILINEAR)
+    if scale_x != 1.0 or scale_y != 1.0:
+        size = (max(1, int(pil_image.width * scale_x)), max(1, int(pil_image.height * scale_y)))
+        pil_image = pil_image.resize(size, Image.Resampling.LANCZOS)
+    return pil_image
+
+
+def edge_pixels(array):
+    """the outermost rows and columns of an [H, W, C] array"""
+    return np.concatenate((array[0], array[-1], array[:, 0], array[:, -1]))
+
+
+@pytest.mark.parametrize("size", [(640, 480), (101, 37), (1, 1), (3000, 17), (7, 1999)])
+def test_rotated_size_matches_pil(layers, size):
+    for angle in ANGLES:
+        expected = Image.new("L", size).rotate(-angle, expand=True).size
+        assert layers.rotated_size(*size, angle) == expected, angle
+
+
+@pytest.mark.parametrize("scale_x,scale_y", SCALES)
+def test_rotate_and_scale_size(layers, scale_x, scale_y):
+    image = smooth_image()
+    for angle in ANGLES:
+        expected = rotate_then_scale(image, angle, scale_x, scale_y).size
+        assert layers.rotate_and_scale(image, angle, scale_x, scale_y).size == expected, angle
+
+
+@pytest.mark.parametrize("scale_x,scale_y", SCALES)
+def test_rotate_and_scale_parity(layers, scale_x, scale_y):
+    image = smooth_image()
+    for angle in ANGLES:
+        expected = np.asarray(rotate_then_scale(image, angle, scale_x, scale_y), dtype=np.float32) / 255
+        result = np.asarray(layers.rotate_and_scale(image, angle, scale_x, scale_y), dtype=np.float32) / 255
+        if scale_x >= 1.0 and scale_y >= 1.0:
+            # nothing to decimate, both paths do the same operations
+            assert np.array_equal(result, expected), angle
+        else:
+            # only the rotated edges and the resampling order differ
+            assert np.abs(result - expected).mean() < 0.01, angle
+            # and the border isn't darkened by a frame of the rotation's fill
+            assert edge_pixels(result).mean() > edge_pixels(expected).mean() - 0.02, angle
+
+
+def test_position_layer_parity(layers):
+    # the whole pil placement, image and mask, against rotating at full size before placing
+    image = smooth_image(300, 200)
+    image_tensor = layers.pil2tensor(image)
+    mask_tensor = torch.zeros((1, 200, 300))
+    angle, scale = 30, 0.4
+    expected_image = layers.pil2tensor(rotate_then_scale(image, angle, scale, scale))
+    expected_mask = layers.pil2tensor(rotate_then_scale(layers.tensor2pil(mask_tensor), angle, scale, scale))
+    expected = layers.place_on_canvas(expected_image, 256, 256, 20, 10, 1.0, 1.0, expected_mask)
+
+    positioned = layers.position_layer(image_tensor, mask_tensor, 256, 256, 20 + 8, 10 + 8, 8, angle, scale, scale)
+
+    for result, reference in zip(positioned, expected):
+        assert result.shape == reference.shape
+        assert (result - reference).abs().mean() < 0.03
+
+
+def layer_jobs(layers, count, width, height, canvas):
+    """position_layer arguments of count rotated and scaled layers spread over the canvas"""
+    jobs = []
+    for index in range(count):
+        image = layers.pil2tensor(smooth_image(width, height))
+        mask = torch.zeros((1, height, width))
+        jobs.append((image, mask, canvas, canvas, 8 + 40 * index, 8 + 30 * index, 8, 10 + 20 * index, 0.3 + 0.05 * index, 0.3 + 0.05 * index))
+    return jobs
+
+
+def assert_same_layers(results, expected):
+    assert len(results) == len(expected)
+    for result, reference in zip(results, expected):
+        for layer, reference_layer in zip(result, reference):
+            assert (layer["left"], layer["top"], layer["fill"]) == (reference_layer["left"], reference_layer["top"], reference_layer["fill"])
+            assert torch.equal(layer["tile"], reference_layer["tile"])
+
+
+def test_position_layers_workers_keep_order(layers):
+    jobs = layer_jobs(layers, 5, 200, 150, 256)
+    serial = layers.position_layers(jobs, 256, 256, workers=1)
+    assert_same_layers(layers.position_layers(jobs, 256, 256, workers=3), serial)
+    # each result is the layer of its own job
+    assert_same_layers(serial, [layers.position_layers([job], 256, 256)[0] for job in jobs])
+
+
+@pytest.mark.benchmark
+def test_position_layers_workers_timing(layers):
+    # 8 large layers, rotated and scaled down onto a 2048 canvas
+    jobs = layer_jobs(layers, 8, 4000, 3000, 2048)
+    workers = min(8, os.cpu_count() or 1)
+
+    timings = {}
+    results = {}
+    for count in (1, workers):
+        start = time.perf_counter()
+        results[count] = layers.position_layers(jobs, 2048, 2048, workers=count)
+        timings[count] = time.perf_counter() - start
+    print(f"\nposition_layers, 8 layers 4000x3000: 1 worker {timings[1]:.2f} s, {workers} workers {timings[workers]:.2f} s "
+          f"({timings[1] / timings[workers]:.1f}x)")
+
+    assert_same_layers(results[workers], results[1])
+    if workers > 1:
+        assert timings[workers] < timings[1]
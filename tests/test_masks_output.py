@@ -0,0 +1,70 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+
+@pytest.fixture(scope="module")
+def masks_output(repo_module):
+    return repo_module("CompositorMasksOutputV3")
+
+
+def storage_bytes(tensors):
+    """memory held by tensors, views sharing a storage counted once"""
+    storages = {}
+    for tensor in tensors:
+        storage = tensor.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+    return sum(storages.values())
+
+
+def test_unpack_outputs_memory_4k(masks_output):
+    # 8 slots on a 4K canvas, a single 512px layer (the one consumer), the other slots empty
+    width, height = 3840, 2160
+    tile = torch.rand((1, 512, 512, 3))
+    tile_mask = torch.zeros((1, 512, 512))
+    layer_outputs = {
+        "images": [{"tile": tile, "left": 100, "top": 200, "fill": 0.0}] + [None] * 7,
+        "masks": [{"tile": tile_mask, "left": 100, "top": 200, "fill": 1.0}] + [None] * 7,
+        "canvas_width": width,
+        "canvas_height": height,
+    }
+
+    outputs = masks_output.CompositorMasksOutputV3().unpack_outputs(layer_outputs)
+
+    transported = storage_bytes([tile, tile_mask])
+    held = storage_bytes(outputs)
+    canvas = width * height * 4
+    dense = 8 * canvas * 3 + 8 * canvas
+    print(f"\nlayer_outputs: {transported / 2**20:.1f} MiB, 16 outputs: {held / 2**20:.1f} MiB "
+          f"(16 dense canvases: {dense / 2**20:.1f} MiB)")
+
+    # the compositor output only carries the tile, a full canvas is 4x larger than all of it
+    assert transported * 4 < canvas
+    # the consumed layer is a real canvas
+    assert outputs[0].is_contiguous() and outputs[8].is_contiguous()
+    # the 7 empty slots are broadcast views of a single value, they allocate nothing
+    for output in outputs[1:8] + outputs[9:]:
+        assert output.shape[1:3] == (height, width)
+        assert output.untyped_storage().nbytes() <= 3 * 4
+    assert held == canvas * 3 + canvas + 7 * (3 * 4 + 4)
+    # about an eighth of materializing every slot
+    assert held * 7 < dense
+
+
+def test_unpack_outputs_content(masks_output):
+    tile = torch.rand((1, 4, 4, 3))
+    layer_outputs = {
+        "images": [None, {"tile": tile, "left": 2, "top": 1, "fill": 0.0}] + [None] * 6,
+        "masks": [None, {"tile": torch.zeros((1, 4, 4)), "left": 2, "top": 1, "fill": 1.0}] + [None] * 6,
+        "canvas_width": 8,
+        "canvas_height": 6,
+    }
+
+    outputs = masks_output.CompositorMasksOutputV3().unpack_outputs(layer_outputs)
+
+    assert torch.equal(outputs[1][0, 1:5, 2:6], tile[0])
+    assert outputs[1][0, :1].max() == 0 and outputs[1][0, :, :2].max() == 0
+    assert outputs[9][0, 1:5, 2:6].max() == 0 and outputs[9].sum() == 8 * 6 - 16
+    # empty slots: black image, white (transparent) mask
+    assert outputs[0].shape == (1, 6, 8, 3) and outputs[0].max() == 0
+    assert outputs[8].shape == (1, 6, 8) and outputs[8].min() == 1
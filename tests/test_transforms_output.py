@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+pytest.importorskip("numpy")
+
+
+@pytest.fixture(scope="module")
+def transforms_output(repo_module):
+    return repo_module("CompositorTransformsOut3")
+
+
+def layout(**extra):
+    return dict({
+        "width": 512,
+        "height": 512,
+        "padding": 10,
+        "transforms": [{"left": 110, "top": 60, "xwidth": 100, "xheight": 50, "scaleX": 2.0, "scaleY": 1.0, "angle": 0}],
+        "bboxes": [{"left": 110, "top": 60, "xwidth": 200, "xheight": 50}],
+        "keyframes": [{"start": {"bbox": {"left": 110}}, "end": {"bbox": {"left": 210}}}],
+        # fabric state the transforms outputs never read
+        "objects": [{"src": "data:image/png;base64," + "A" * 1000}],
+    }, **extra)
+
+
+def test_transform_data_keeps_only_the_layout_fields(transforms_output):
+    transform_data = transforms_output.parse_transforms(json.dumps(layout()), layer_frames=[3])
+    assert transform_data["layouts"] == [{key: value for key, value in layout().items() if key in transforms_output.LAYOUT_FIELDS}]
+    assert [record.bbox_x for record in transform_data["layers"][0]] == [100, 150, 200]
+
+
+def test_retime_transforms(transforms_output):
+    transform_data = transforms_output.parse_transforms(layout(), layer_frames=[3])
+    retimed = transforms_output.retime_transforms(transform_data, 5)
+    assert [record.bbox_x for record in retimed["layers"][0]] == [100, 125, 150, 175, 200]
+    assert retimed["variants"] == 1
+
+
+def test_run_outputs_empty_lists_without_layers(transforms_output):
+    node = transforms_output.CompositorTransformsOutV3()
+    # the compositor's fallback for unparsable fabricData
+    outputs = node.run(channel=1, forceInt=True, transform_data={"layers": [], "variants": 0})
+    assert outputs == tuple([] for _ in node.RETURN_TYPES)
+    # a channel past the document's layers
+    outputs = node.run(channel=4, forceInt=True, transform_data=transforms_output.parse_transforms(layout(), layer_frames=[1]))
+    assert outputs == tuple([] for _ in node.RETURN_TYPES)
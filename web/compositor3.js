@@ -203,7 +203,9 @@ app.registerExtension({
 
             const images = [...e.names];
 
-            const restore = Editor.deserializeStuff(node.fabricDataWidget.value);
+            const deserialized = Editor.deserializeStuff(node.fabricDataWidget.value);
+            // a layout sweep holds an array of layouts, the canvas shows the first one
+            const restore = Array.isArray(deserialized) ? deserialized[0] : deserialized;
             const shouldRestore = restore ?? false; // Editor.getConfigWidgetValue(node, 3);
             const normalizeHeight = Editor.getConfigWidgetValue(node, 3);
             const onConfigChanged = Editor.getConfigWidgetValue(node, 4);
@@ -211,6 +213,14 @@ app.registerExtension({
             instance.normalizeHeigh = normalizeHeight;
             instance.onConfigChanged = onConfigChanged;
             instance.configChanged = e.configChanged[0];
+            // the backend is waiting in-process for the next upload (continueMode await)
+            instance.awaiting = e.awaiting ? e.awaiting[0] : false;
+            // the waiting execution, /compositor/done resumes only that prompt
+            instance.promptId = e.prompt_id ? e.prompt_id[0] : null;
+            // render "server": the composite is made by the backend, nothing to upload or re-enqueue
+            instance.headless = e.headless ? e.headless[0] : false;
+            // layout sweep: fabricData is an array and must not be overwritten by serializeStuff
+            instance.sweep = e.sweep ? e.sweep[0] : false;
 
             images.map((b64, index) => {
                 function fromUrlCallback(oImg) {
@@ -221,11 +231,22 @@ app.registerExtension({
                  * fabric.Image.fromURL
                  * http://fabricjs.com/docs/fabric.Image.html
                  */
-                fabric.Image.fromURL(b64, fromUrlCallback);
+                // previews are served by the backend (/compositor/preview/{digest}), data urls still work
+                const src = b64 && !b64.startsWith("data:") ? api.apiURL(b64) : b64;
+                fabric.Image.fromURL(src, fromUrlCallback);
 
             });
 
-            if(instance.configChanged) {
+            if(instance.headless) {
+                // the backend did not block, the run already has its composite
+                instance.needsUpload = false;
+            } else if(instance.awaiting) {
+                // no re-enqueue: the upload posts /compositor/done and the execution resumes
+                instance.needsUpload = true;
+                if(onConfigChanged){
+                    instance.uploadIfNeeded(instance);
+                }
+            } else if(instance.configChanged) {
 
                 instance.needsUpload = true;
 
@@ -503,7 +524,12 @@ app.registerExtension({
 
         // make sure when we reload the widget will be re-executed
         const firstRun = Editor.deserializeStuff(node.fabricDataWidget.value);
-        firstRun["firstRun"] = Date.now();
+        if (Array.isArray(firstRun)) {
+            // a layout sweep, stamp every layout so the array survives the round trip
+            firstRun.forEach((layout) => layout["firstRun"] = Date.now());
+        } else {
+            firstRun["firstRun"] = Date.now();
+        }
         node.fabricDataWidget.value = JSON.stringify(firstRun);
 
         const containerDiv = Editor.createCompositorContainerDiv(node)
@@ -1047,8 +1073,14 @@ class Editor {
 
             node.setDirtyCanvas(true, true);
             if (callback) callback()
-            // deprecated, not really needed anymore
-            if (setDone) api.fetchApi("/compositor/done", {method: "POST", body});
+            // resumes a compositor awaiting the upload (continueMode await) with the latest transforms
+            if (setDone || node.compositorInstance.awaiting) {
+                node.compositorInstance.awaiting = false;
+                body.append('fabricData', node.fabricDataWidget.value);
+                if (node.compositorInstance.promptId) body.append('prompt_id', node.compositorInstance.promptId);
+                body.append('client_id', api.clientId);
+                api.fetchApi("/compositor/done", {method: "POST", body});
+            }
 
         }, () => {
             console.log("some error")
@@ -1107,9 +1139,9 @@ class Editor {
 
             this.cblob = blob;
 
-            // serialization of transforms
-            const serialized = Editor.serializeStuff(this.node);
-            if (!serialized.includes("[null,null,null,null,null,null,null,null]")) {
+            // serialization of transforms, a layout sweep keeps its array of layouts
+            const serialized = this.sweep ? undefined : Editor.serializeStuff(this.node);
+            if (serialized && !serialized.includes("[null,null,null,null,null,null,null,null]")) {
                 this.node.fabricDataWidget.value = serialized;
                 //  console.log(node.stuff.fabricDataWidget.value)
             }
@@ -1259,7 +1291,11 @@ class Editor {
 
     uploadIfNeeded(compositorInstance,callback = ()=>{console.log("upload if needed")}) {
 
-        if (compositorInstance.needsUpload) {
+        if (compositorInstance.sweep) {
+            // the layouts of a sweep are edited in the widget, not on the canvas
+            compositorInstance.needsUpload = false;
+            console.log("layout sweep, no upload");
+        } else if (compositorInstance.needsUpload) {
             compositorInstance.needsUpload = false;
             const serialized = Editor.serializeStuff(compositorInstance.node);
             compositorInstance.node.fabricDataWidget.value = serialized;
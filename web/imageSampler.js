@@ -32,8 +32,10 @@ app.registerExtension({
                 widget.value = detail.value;
                 app.graph.setDirtyCanvas(true);
                 
-                // Run the workflow again to continue processing
-                app.queuePrompt(0, 1); // Continue the workflow
+                // Run the workflow again to continue processing, unless the sampler resumed in-process
+                if (detail.requeue !== false) {
+                    app.queuePrompt(0, 1); // Continue the workflow
+                }
             }
         });
     },
@@ -163,6 +165,7 @@ app.registerExtension({
                 let selectedPoint = -1;
                 let isDragging = false;
                 let nodeId = null;
+                let promptId = null;
                 
                 // Store actual dimensions of the original image
                 let originalImageWidth = 0;
@@ -174,6 +177,7 @@ app.registerExtension({
                     
                     // Store node ID for API calls
                     nodeId = data.node_id;
+                    promptId = data.prompt_id ?? null;
                     
                     // Load points if any
                     if (data.sample_points && Array.isArray(data.sample_points)) {
@@ -219,7 +223,8 @@ app.registerExtension({
                         drawSamplePoints();
                     };
                     
-                    img.src = base64Data;
+                    // previews served by the preview route are relative to the api
+                    img.src = base64Data.startsWith("data:") ? base64Data : api.apiURL(base64Data);
                 };
                 
                 // Function to continue workflow
@@ -232,6 +237,8 @@ app.registerExtension({
                         headers: { "Content-Type": "application/json" },
                         body: JSON.stringify({
                             node_id: nodeId,
+                            prompt_id: promptId,
+                            client_id: api.clientId,
                             sample_points: samplePoints
                         })
                     }).catch(err => console.error("Error continuing workflow:", err));